@@ -1,14 +1,16 @@
-import aiofiles
-import aiofiles.os
+from core.cache import get_caches
+from core.diagnostics import MemoryProfiler, fds_report, tasks_report
+import asyncio
 import discord
-import random
-import subprocess
+import io
+import sys
 from discord.ext import commands
 from os import environ
 
 class Admin(commands.Cog):
     def __init__(self, bot):
         self.bot: discord.Bot = bot
+        self._memory_profiler = MemoryProfiler()
 
     # Shutdown command
     @commands.command(aliases=['exit', 'stop', 'quit', 'shutdown'])
@@ -22,6 +24,16 @@ class Admin(commands.Cog):
         # Shutdown aiohttp client and the bot
         #if hasattr(self.bot, "_aiohttp_session"):   
         #    await self.bot._aiohttp_session.close()
+        if hasattr(self.bot, "media_pipeline"):
+            await self.bot.media_pipeline.close()
+        if hasattr(self.bot, "reddit_posts"):
+            await self.bot.reddit_posts.close()
+        if hasattr(self.bot, "executors"):
+            self.bot.executors.shutdown()
+        if hasattr(self.bot, "voice_nodes"):
+            self.bot.voice_nodes.close()
+        if hasattr(self.bot, "loop_monitor"):
+            self.bot.loop_monitor.stop()
 
         await self.bot.close()
 
@@ -43,29 +55,176 @@ class Admin(commands.Cog):
 
         # For now, shell output is disabled as it is having trouble with parsing "/" character as arguments, thus this is a security risk
         # For PIPING, we just typically use $execute bash -c "command | pipe"
-        output = None
+        _timeout = float(environ.get("ADMIN_EXECUTE_TIMEOUT", 120))
+        _max_output = int(environ.get("ADMIN_EXECUTE_MAX_OUTPUT", 1024 * 1024))
         try:
-            output = subprocess.run(shell_command, shell = False,capture_output = True)
-        except FileNotFoundError:
-            await ctx.respond(f"Cannot execute `{pretty_shell_command}`, no such file or directory.")
-        
-        # Check if we should send the output to file 
-        _xfilepath = f"{environ.get('TEMP_DIR')}/output{random.randint(3928,10029)}.txt"
-        if output.stdout:
-            # If the output exceeds 2000 characters, send it as a file
-            if len(output.stdout.decode('utf-8')) > 2000:
-                async with aiofiles.open(_xfilepath, "w+") as f:
-                    await f.write(output.stdout.decode('utf-8'))
-
-                await ctx.respond(f"I executed `{pretty_shell_command}` and got:", file=discord.File(_xfilepath, "output.txt"))
-
-                # Delete the file
-                await aiofiles.os.remove(_xfilepath)
-            else:
-                await ctx.respond(f"I executed `{pretty_shell_command}` and got:")
-                await ctx.send(f"```{output.stdout.decode('utf-8')}```")
+            _process = await asyncio.create_subprocess_exec(*shell_command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        except OSError as e:
+            await ctx.send(f"Cannot execute `{pretty_shell_command}`, {e.strerror or e}.")
+            return
+
+        # Output is streamed into the status message, only the last ADMIN_EXECUTE_MAX_OUTPUT bytes are kept
+        _output = bytearray()
+        _output_total = 0
+
+        async def _read_output():
+            nonlocal _output_total
+            while _chunk := await _process.stdout.read(4096):
+                _output.extend(_chunk)
+                _output_total += len(_chunk)
+                if len(_output) > _max_output:
+                    del _output[:len(_output) - _max_output]
+
+        # Fits the output in a code block below the header within the 2000 characters message limit
+        # The output is escaped before it is trimmed since escaping makes it longer
+        def _with_output(header: str) -> str:
+            _limit = max(100, 1990 - len(header))
+            # A zero width space after every backtick so the output can't close the code block
+            _text = _output[-_limit:].decode("utf-8", errors="replace").replace("`", "`\u200b")
+            return f"{header}\n```{_text[-_limit:]}```"
+
+        _message = await ctx.send(f"⌛ Executing `{pretty_shell_command}`...")
+        _reader = asyncio.create_task(_read_output())
+        _deadline = asyncio.get_running_loop().time() + _timeout
+        _timed_out = False
+        _last_shown = 0
+        while not _reader.done():
+            await asyncio.wait({_reader}, timeout=1.5)
+
+            if asyncio.get_running_loop().time() >= _deadline and not _reader.done():
+                _timed_out = True
+                _process.kill()
+                break
+
+            # Edit the message only when there is new output
+            if _output_total != _last_shown and not _reader.done():
+                _last_shown = _output_total
+                await _message.edit(content=_with_output(f"⌛ Executing `{pretty_shell_command}`..."))
+
+        # Processes that spawned children may keep the pipe open after being killed
+        try:
+            await asyncio.wait_for(_reader, timeout=5)
+        except asyncio.TimeoutError:
+            _reader.cancel()
+        _returncode = await _process.wait()
+
+        _status = f"⏱️ `{pretty_shell_command}` timed out after {round(_timeout)} seconds and was killed" if _timed_out else f"I executed `{pretty_shell_command}` (exit code {_returncode})"
+        if _output_total == 0:
+            await _message.edit(content=f"{_status} and got no output")
+        elif _output_total > 1990 - len(_status) - 10:
+            # Send the output as a file from memory when it doesn't fit in a message
+            _truncated = f", showing the last {len(_output)} bytes of {_output_total}" if _output_total > len(_output) else ""
+            await _message.delete()
+            await ctx.send(f"{_status} and got{_truncated}:", file=discord.File(io.BytesIO(bytes(_output)), "output.txt"))
+        else:
+            await _message.edit(content=_with_output(f"{_status} and got:"))
+
+    # Diagnostics commands
+    async def _send_report(self, ctx, title: str, report: str):
+        # Reports that don't fit in a message are sent as a file
+        if len(report) > 1900 - len(title):
+            await ctx.send(f"{title}:", file=discord.File(io.BytesIO(report.encode("utf-8")), "report.txt"))
+        else:
+            await ctx.send(f"{title}:\n```{report}```")
+
+    @commands.group(aliases=['diag'], invoke_without_command=True)
+    async def admin_diag(self, ctx):
+        """Runtime diagnostics of the bot: lag, tasks, caches, fds and memory (owner only)"""
+        if ctx.author.id != int(environ.get("SYSTEM_USER_ID")):
+            await ctx.respond("Only my master can do that >:(")
+            return
+
+        await ctx.send(f"Usage: `{ctx.clean_prefix}{ctx.invoked_with} <lag|tasks|caches|fds|memory>`")
+
+    @admin_diag.command(name="lag")
+    async def admin_diag_lag(self, ctx):
+        """Event loop lag percentiles"""
+        if ctx.author.id != int(environ.get("SYSTEM_USER_ID")):
+            await ctx.respond("Only my master can do that >:(")
+            return
+
+        if not hasattr(self.bot, "loop_monitor"):
+            await ctx.send("The event loop lag monitor is not running")
+            return
+
+        _stats = self.bot.loop_monitor.lag_stats()
+        await self._send_report(ctx, "⏱️ Event loop lag", "\n".join(f"{_key}: {_value}" for _key, _value in _stats.items()))
+
+    @admin_diag.command(name="tasks")
+    async def admin_diag_tasks(self, ctx, limit: int = 10, stacks: int = 3):
+        """Most numerous and longest running asyncio tasks with their stacks"""
+        if ctx.author.id != int(environ.get("SYSTEM_USER_ID")):
+            await ctx.respond("Only my master can do that >:(")
+            return
+
+        await self._send_report(ctx, "🧵 Tasks", tasks_report(getattr(self.bot, "loop_monitor", None), limit=limit, stacks=stacks))
+
+    @admin_diag.command(name="caches")
+    async def admin_diag_caches(self, ctx):
+        """Sizes and hit rates of caches, executor pools and voice state"""
+        if ctx.author.id != int(environ.get("SYSTEM_USER_ID")):
+            await ctx.respond("Only my master can do that >:(")
+            return
+
+        _lines = ["Caches:"]
+        for _name, _cache in sorted(get_caches().items()):
+            _lookups = _cache.hits + _cache.misses
+            _hit_rate = f"{_cache.hits / _lookups:.0%}" if _lookups else "-"
+            _lines.append(f"  {_name}: {len(_cache)}/{_cache.max_size} entries, {_cache.hits} hits, {_cache.misses} misses ({_hit_rate})")
+
+        # Only report the embedding caches if the module was loaded
+        _embeddings = sys.modules.get("core.ai.embeddings")
+        if _embeddings is not None:
+            for _model, _embedding_cache in _embeddings.get_embedding_caches().items():
+                _lines.append(f"  embeddings ({_model}): {_embedding_cache.stats()}")
+
+        if hasattr(self.bot, "executors"):
+            _lines += ["", "Executors:"]
+            _lines += [f"  {_pool}: {_stats}" for _pool, _stats in self.bot.executors.stats().items()]
+
+        _voice = self.bot.get_cog("Voice")
+        if _voice is not None:
+            _lines += [
+                "",
+                "Voice:",
+                f"  enqueued_tracks: {len(_voice.enqueued_tracks)} guilds, {sum(len(_queue) for _queue in _voice.enqueued_tracks.values())} tracks",
+                f"  controllers: {len(_voice.controllers)}",
+                f"  current_user: {len(_voice.current_user)}",
+                f"  pendings: {len(_voice.pendings)}",
+                f"  voice_clients: {len(self.bot.voice_clients)}"
+            ]
+
+        await self._send_report(ctx, "🗃️ Caches", "\n".join(_lines))
+
+    @admin_diag.command(name="fds")
+    async def admin_diag_fds(self, ctx):
+        """Open file descriptors and TCP connections"""
+        if ctx.author.id != int(environ.get("SYSTEM_USER_ID")):
+            await ctx.respond("Only my master can do that >:(")
+            return
+
+        await self._send_report(ctx, "🔌 Open file descriptors", await asyncio.to_thread(fds_report))
+
+    @admin_diag.command(name="memory")
+    async def admin_diag_memory(self, ctx, action: str = "snapshot", limit: int = 15):
+        """Trace memory allocations: start, snapshot (top allocations and difference since the previous snapshot) or stop"""
+        if ctx.author.id != int(environ.get("SYSTEM_USER_ID")):
+            await ctx.respond("Only my master can do that >:(")
+            return
+
+        if action == "start":
+            self._memory_profiler.start(int(environ.get("TRACEMALLOC_FRAMES", 1)))
+            await ctx.send("🧠 Started tracing memory allocations, take snapshots with `memory snapshot`")
+        elif action == "stop":
+            self._memory_profiler.stop()
+            await ctx.send("🧠 Stopped tracing memory allocations")
+        elif action == "snapshot":
+            if not self._memory_profiler.tracing:
+                await ctx.send("Memory allocations are not traced, start tracing with `memory start`")
+                return
+            await self._send_report(ctx, "🧠 Memory", await self._memory_profiler.snapshot(limit=limit))
         else:
-            await ctx.respond(f"I executed `{pretty_shell_command}` and got no output")
+            await ctx.send("Unknown action, use `start`, `snapshot` or `stop`")
 
 
 def setup(bot):
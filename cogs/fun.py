@@ -18,15 +18,15 @@ class Fun(commands.Cog):
         await ctx.response.defer(ephemeral=True)
 
         if isinstance(user, int):
-            user = await self.bot.fetch_user(user)    
+            user = await self.bot.entity_cache.get_user(user)
         avatar_url = user.avatar.url if user.avatar else "https://cdn.discordapp.com/embed/avatars/0.png"
 
         # Set display name depending on whether if the user joins in particular guild or in DMs to have different display names
         if ctx.guild:
-            _xuser_display_name = await ctx.guild.fetch_member(user.id)
+            _xuser_display_name = await self.bot.entity_cache.get_member(ctx.guild, user.id)
             user_name = f"{_xuser_display_name.display_name}"
         else:
-            _xuser_display_name = await self.bot.fetch_user(user.id)
+            _xuser_display_name = await self.bot.entity_cache.get_user(user.id)
             user_name = f"{_xuser_display_name.display_name}"
 
         webhook = await ctx.channel.create_webhook(name=f"Mimic command by {self.author}")
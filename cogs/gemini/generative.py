@@ -1,16 +1,14 @@
 from core.ai.assistants import Assistants
 from core.ai.core import GenAIConfigDefaults, ModelsList
 from core.ai.history import History
+from core.ai.media import FileProcessingFailed
 from discord.ext import commands
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 from os import environ, remove
-from pathlib import Path
 import google.generativeai as genai
 import google.api_core.exceptions
 import aiohttp
 import aiofiles
-import aiofiles.os
-import asyncio
 import discord
 import importlib
 import inspect
@@ -105,7 +103,7 @@ class BaseChat(commands.Cog):
 
         # Load and deserialize the chat data
         _prompt_count, _chat_thread = await self.HistoryManagement.load_history(guild_id=guild_id)
-        _chat_thread = await asyncio.to_thread(jsonpickle.decode, _chat_thread, keys=True) if _chat_thread is not None else []
+        _chat_thread = await self.bot.executors.run_thread(jsonpickle.decode, _chat_thread, keys=True) if _chat_thread is not None else []
 
         if _prompt_count >= int(environ.get("MAX_CONTEXT_HISTORY", 20)):
             raise MemoryError("Maximum history reached! Clear the conversation")
@@ -130,43 +128,23 @@ class BaseChat(commands.Cog):
             if hasattr(_Tool, "file_uri"):
                 _Tool.file_uri = attachment.url
 
-            # Download the attachment
-            _xfilename = f"{environ.get('TEMP_DIR')}/JAKEY.{guild_id}.{random.randint(5000, 6000)}.{attachment.filename}"
+            # Download the attachment and upload the file to the server
+            _x_msgstatus = None
+            async def _processing_status():
+                nonlocal _x_msgstatus
+                if verbose_logs:
+                    _x_msgstatus = await ctx.send("⌛ Processing the file attachment... this may take a while")
+
             try:
-                async with aiohttp.ClientSession() as _download_session:
-                    async with _download_session.get(attachment.url, allow_redirects=True) as _xattachments:
-                        # write to file with random number ID
-                        async with aiofiles.open(_xfilename, "wb") as filepath:
-                            async for _chunk in _xattachments.content.iter_chunked(8192):
-                                await filepath.write(_chunk)
+                _xfile_uri = await self.bot.media_pipeline.ingest(attachment, prefix=f"JAKEY.{guild_id}", on_processing=_processing_status)
             except aiohttp.ClientError as httperror:
-                # Remove the file if it exists ensuring no data persists even on failure
-                if Path(_xfilename).exists():
-                    await aiofiles.os.remove(_xfilename)
-                # Raise exception
                 raise httperror
-
-            # Upload the file to the server
-            try:
-                _xfile_uri = await asyncio.to_thread(genai.upload_file, path=_xfilename, display_name=_xfilename.split("/")[-1])
-                _x_msgstatus = None
-
-                # Wait for the file to be uploaded
-                while _xfile_uri.state.name == "PROCESSING":
-                    if verbose_logs:
-                        if _x_msgstatus is None:
-                            _x_msgstatus = await ctx.send("⌛ Processing the file attachment... this may take a while")
-                    await asyncio.sleep(3)
-                    _xfile_uri = await asyncio.to_thread(genai.get_file, _xfile_uri.name)
-
-                if _xfile_uri.state.name == "FAILED":
-                    await ctx.respond("❌ Sorry, I can't process the file attachment. Please try again.")
-                    raise ValueError(_xfile_uri.state.name)
+            except FileProcessingFailed:
+                await ctx.respond("❌ Sorry, I can't process the file attachment. Please try again.")
+                return
             except Exception as e:
                 await ctx.respond(f"❌ An error has occured when uploading the file or the file format is not supported\nLog:\n```{e}```")
                 return
-            finally:
-                await aiofiles.os.remove(_xfilename)
 
             # Immediately use the "used" status message to indicate that the file API is used
             if verbose_logs:
@@ -272,7 +250,7 @@ class BaseChat(commands.Cog):
         # Increment the prompt count
         _prompt_count += 1
         # Also save the ChatSession.history attribute to the context history chat history key so it will be saved through pickle
-        _chat_thread = await asyncio.to_thread(jsonpickle.encode, chat_session.history, indent=4, keys=True)
+        _chat_thread = await self.bot.executors.run_thread(jsonpickle.encode, chat_session.history, indent=4, keys=True)
 
         # Print context size and model info
         if append_history:
@@ -1,14 +1,10 @@
 from core.ai.assistants import Assistants
 from core.ai.core import GenAIConfigDefaults
+from core.cache import SingleFlight, TTLCache
 from discord.ext import commands
 from os import environ
-import aiohttp
-import aiofiles
-import asyncio
 import discord
 import google.generativeai as genai
-import logging
-import random
 
 class GenAIApps(commands.Cog):
     def __init__(self, bot):
@@ -27,6 +23,39 @@ class GenAIApps(commands.Cog):
         # Assistants
         self._system_prompt = Assistants()
 
+        # Popular messages are often invoked by many members at once, so identical requests share one generation
+        # (action, message id) -> (message edited_at, generated text)
+        self._results = TTLCache("message_actions", ttl=float(environ.get("MESSAGE_ACTIONS_CACHE_TTL", 600)), max_size=512)
+        self._flights = SingleFlight()
+
+    ###############################################
+    # Shared generations
+    ###############################################
+    async def _generate_once(self, action: str, message: discord.Message, generate_func):
+        # Results are only reused for the same revision of the message
+        _cached = self._results.get((action, message.id))
+        if _cached is not None and _cached[0] == message.edited_at:
+            return _cached[1]
+
+        async def _generate():
+            _text = await generate_func()
+            self._results.set((action, message.id), (message.edited_at, _text))
+            return _text
+
+        return await self._flights.do((action, message.id, message.edited_at), _generate)
+
+    def _invalidate(self, message_id: int):
+        for _action in ("rephrase", "explain", "suggest"):
+            self._results.pop((_action, message_id))
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        self._invalidate(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        self._invalidate(payload.message_id)
+
     ###############################################
     # Rephrase command
     ###############################################
@@ -39,14 +68,18 @@ class GenAIApps(commands.Cog):
         """Rephrase this message"""
         await ctx.response.defer(ephemeral=True)
         
-        # Generative model settings
-        _model = genai.GenerativeModel(model_name=self._genai_configs.model_config, system_instruction=self._system_prompt.message_rephraser_prompt, generation_config=self._genai_configs.generation_config)
-        _answer = await _model.generate_content_async(f"Rephrase this message:\n{str(message.content)}")
+        async def _rephrase():
+            # Generative model settings
+            _model = genai.GenerativeModel(model_name=self._genai_configs.model_config, system_instruction=self._system_prompt.message_rephraser_prompt, generation_config=self._genai_configs.generation_config)
+            _answer = await _model.generate_content_async(f"Rephrase this message:\n{str(message.content)}")
+            return _answer.text
+
+        _answer = await self._generate_once("rephrase", message, _rephrase)
 
         # Send message in an embed format
         _embed = discord.Embed(
                 title="Rephrased Message",
-                description=str(_answer.text),
+                description=str(_answer),
                 color=discord.Color.random()
         )
         _embed.set_footer(text="Responses generated by AI may not give accurate results! Double check with facts!")
@@ -81,21 +114,29 @@ class GenAIApps(commands.Cog):
         await ctx.response.defer(ephemeral=True)
 
 
-        # Generative model settings
-        _model = genai.GenerativeModel(model_name=self._genai_configs.model_config, system_instruction=self._system_prompt.message_summarizer_prompt, generation_config=self._genai_configs.generation_config)
-        _answer = await _model.generate_content_async([
-            {
-                "role":"user",
-                "parts":[
-                    f"Explain and summarize based on this message:\n{str(message.content)}"
-                ]
-            }
-        ])
+        async def _explain():
+            # Download and upload attachments concurrently, max files is 5
+            _attachment_data = await self.bot.media_pipeline.ingest_many(message.attachments[:5])
+
+            # Generative model settings
+            _model = genai.GenerativeModel(model_name=self._genai_configs.model_config, system_instruction=self._system_prompt.message_summarizer_prompt, generation_config=self._genai_configs.generation_config)
+            _answer = await _model.generate_content_async([
+                {
+                    "role":"user",
+                    "parts":[
+                        *_attachment_data,
+                        f"Explain and summarize based on this message:\n{str(message.content)}"
+                    ]
+                }
+            ])
+            return _answer.text
+
+        _answer = await self._generate_once("explain", message, _explain)
 
         # Send message in an embed format
         _embed = discord.Embed(
                 title="Explain this message",
-                description=str(_answer.text),
+                description=str(_answer),
                 color=discord.Color.random()
         )
         _embed.set_footer(text="Responses generated by AI may not give accurate results! Double check with facts!\nSome data like images or attachments may be included in the context, do not include with sensitive information!")
@@ -129,40 +170,30 @@ class GenAIApps(commands.Cog):
         """Suggest a response based on this message"""
         await ctx.response.defer(ephemeral=True)
 
-        # Download attachments
-        _attachment_data = []
-        _batches = {}
-        if message.attachments and len(message.attachments) > 0:
-            for _x in message.attachments:
-                _batches.update({_x.url: f"{environ.get('TEMP_DIR')}/JAKEY.{random.randint(5000, 6000)}.{_x.filename}"})
-
-                # Max files is 5
-                if len(_batches) > 5:
-                    break
-
-        # Download attachments and save it to _attachment_data
-        try:
-            # This will return all values as list (Future[list]) from the function
-            _attachment_data = await asyncio.gather(*[self._media_download(_urls, _batches[_urls]) for _urls in _batches])
-        except Exception as e:
-            logging.warning("apps>Suggest this message: I cannot upload or attach files reason %s", e)
-
-        # Generative model settings
-        _model = genai.GenerativeModel(model_name=self._genai_configs.model_config, system_instruction=self._system_prompt.message_suggestions_prompt, generation_config=self._genai_configs.generation_config)
-        _answer = await _model.generate_content_async([
-            {
-                "role":"user",
-                "parts":[
-                    f"Suggest a response based on this message:\n{str(message.content)}"
-                ]
-            }
-        ])
+        async def _suggest():
+            # Download and upload attachments concurrently, max files is 5
+            _attachment_data = await self.bot.media_pipeline.ingest_many(message.attachments[:5])
+
+            # Generative model settings
+            _model = genai.GenerativeModel(model_name=self._genai_configs.model_config, system_instruction=self._system_prompt.message_suggestions_prompt, generation_config=self._genai_configs.generation_config)
+            _answer = await _model.generate_content_async([
+                {
+                    "role":"user",
+                    "parts":[
+                        *_attachment_data,
+                        f"Suggest a response based on this message:\n{str(message.content)}"
+                    ]
+                }
+            ])
+            return _answer.text
+
+        _answer = await self._generate_once("suggest", message, _suggest)
 
         # To protect privacy, send the message to the user
         # Send message in an embed format
         _embed = discord.Embed(
                 title="Suggested Responses",
-                description=str(_answer.text),
+                description=str(_answer),
                 color=discord.Color.random()
         )
         _embed.set_footer(text="Responses generated by AI may not give accurate results! Double check with facts!\nSome data like images or attachments may be included in the context, include with information!")
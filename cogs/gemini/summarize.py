@@ -1,5 +1,7 @@
 from core.ai.assistants import Assistants
 from core.ai.core import GenAIConfigDefaults, ModelsList
+from core.ai.summaries import SummaryState
+from core.ai.transcript import CompactTranscript
 from discord.ext import commands
 from os import environ
 import google.generativeai as genai
@@ -7,7 +9,10 @@ import aiofiles
 import datetime
 import discord
 import inspect
+import logging
+import motor.motor_asyncio
 import random
+import time
 
 class GenAITools(commands.Cog):
     def __init__(self, bot):
@@ -29,6 +34,14 @@ class GenAITools(commands.Cog):
         # constrain token limit output to 4096 tokens
         self._genai_configs.generation_config.update({"max_output_tokens": 4096})
 
+        # Rolling per-channel summaries, incremental summaries are disabled if MongoDB is not configured
+        self._summary_state = None
+        if environ.get("MONGO_DB_URL"):
+            try:
+                self._summary_state: SummaryState = SummaryState(db_conn=motor.motor_asyncio.AsyncIOMotorClient(environ.get("MONGO_DB_URL")))
+            except Exception as e:
+                logging.warning("summarize: Incremental summaries are disabled, reason: %s", e)
+
    ###############################################
     # Summarize discord messages
     ###############################################
@@ -65,7 +78,12 @@ class GenAITools(commands.Cog):
         default="gemini-1.5-flash-001",
         required=False
     )
-    async def summarize(self, ctx, before_date: str, after_date: str, around_date: str, limit: int, model: str):
+    @discord.option(
+        "fresh",
+        description="Ignore the previous summary of this channel and summarize the messages from scratch",
+        default=False
+    )
+    async def summarize(self, ctx, before_date: str, after_date: str, around_date: str, limit: int, model: str, fresh: bool):
         """Summarize or catch up latest messages based on the current channel"""
         await ctx.response.defer(ephemeral=True)
             
@@ -75,10 +93,10 @@ class GenAITools(commands.Cog):
             return
 
         # additional system prompt providing the user interaction context to provide personalized summaries
-        _xuser_display_name = await ctx.guild.fetch_member(ctx.author.id)
+        _xuser_display_name = await self.bot.entity_cache.get_member(ctx.guild, ctx.author.id)
         
         # Discord channel conversation context
-        _current_discord_convo_context = []
+        _current_discord_convo_context = CompactTranscript(guild_id=ctx.guild.id, channel_id=ctx.channel.id)
 
         # Parse the dates
         if before_date is not None:
@@ -88,29 +106,66 @@ class GenAITools(commands.Cog):
         if around_date is not None:
             around_date = datetime.datetime.strptime(around_date, '%m/%d/%Y')
 
-        messages = ctx.channel.history(limit=limit, before=before_date, after=after_date, around=around_date)
-        async for x in messages:
+        # Only extend the rolling summary when catching up with the latest messages
+        _previous_state = None
+        if self._summary_state is not None and not fresh and before_date is None and after_date is None and around_date is None:
+            _previous_state = await self._summary_state.load_state(channel_id=ctx.channel.id, user_id=ctx.author.id)
+
+            # Discard summaries that are too old to be extended, this also keeps the rolling summary from drifting
+            if _previous_state is not None and time.time() - _previous_state["updated_at"] > float(environ.get("SUMMARY_STATE_MAX_AGE", 24)) * 3600:
+                _previous_state = None
+
+        _note = None
+        if _previous_state is not None:
+            # Only read the messages sent after the last summarized message, newest first
+            # One extra message is read to know if there are more new messages than the limit
+            messages = [x async for x in ctx.channel.history(limit=limit + 1, after=discord.Object(id=_previous_state["last_message_id"]), oldest_first=False)]
+            if len(messages) > limit:
+                # The messages in between would be missing from the rolling summary, start over from the latest messages
+                # (history with after= reads the messages right after the stored one, so the latest messages are read again)
+                messages = [x async for x in ctx.channel.history(limit=limit)]
+                _previous_state = None
+                _note = f"ℹ️ More than {limit} messages were sent since your last summary, here is a summary of the latest {limit} messages instead"
+        else:
+            messages = [x async for x in ctx.channel.history(limit=limit, before=before_date, after=after_date, around=around_date)]
+
+        # Used to mark where the next incremental summary should start
+        _last_message_id = _previous_state["last_message_id"] if _previous_state is not None else None
+        for x in messages:
+            if _last_message_id is None or x.id > _last_message_id:
+                _last_message_id = x.id
+
             # Handle 2000 characters limit since 4000 characters is considered spam
             if len(x.content) <= 2000:
-                _current_discord_convo_context.append(inspect.cleandoc(f"""                                        
-                        ---
-                        # Message by: {x.author.name} at {x.created_at}
+                _current_discord_convo_context.add_message(x)
+            else:
+                continue
 
-                        # Message body:
-                        {x.content}
+        # Messages are referenced by short ids in the prompt, jump links are reconstructed from the response
+        _transcript = _current_discord_convo_context
+        _current_discord_convo_context = _transcript.encode() if len(_transcript) > 0 else ""
 
-                        # Message jump link:
-                        {x.jump_url}
+        # If arguments are given, also display the date
+        _app_title = f"Summary for {ctx.channel.name}"
+        if before_date is not None:
+            _app_title += f" before __{before_date.date()}__"
+        if after_date is not None:
+            _app_title += f" after __{after_date.date()}__"
+        if around_date is not None:
+            _app_title += f" around __{around_date.date()}__"
 
-                        # Additional information:
-                        - Discord User ID: {x.author.id}
-                        - Discord User Display Name: {x.author.display_name}
-                        ---
-                """))
-            else:
-                continue
+        # Nothing new since the last summary, reuse it without calling the model
+        if _previous_state is not None and _last_message_id == _previous_state["last_message_id"]:
+            await self._send_summary(ctx, _app_title, _previous_state["summary"], model)
+            return
 
-        _current_discord_convo_context = "\n".join(_current_discord_convo_context)
+        # Fold the new messages into the previous summary
+        if _previous_state is not None:
+            _current_discord_convo_context = "\n\n".join([
+                self._assistants_system_prompt.discord_msg_summarizer_prompt["incremental_prompt_format"],
+                f"Previous summary:\n{_previous_state['summary']}",
+                f"New messages since the previous summary:\n{_current_discord_convo_context}"
+            ])
 
         #################
         # MODEL
@@ -136,33 +191,34 @@ class GenAITools(commands.Cog):
              {_current_discord_convo_context}
             """))
 
-        # If arguments are given, also display the date
-        _app_title = f"Summary for {ctx.channel.name}"
-        if before_date is not None:
-            _app_title += f" before __{before_date.date()}__"
-        if after_date is not None:
-            _app_title += f" after __{after_date.date()}__"
-        if around_date is not None:
-            _app_title += f" around __{around_date.date()}__"
+        _summary_text = _transcript.expand_references(_summary.text)
+
+        # Save the rolling summary for the next catch-up, only when reading the latest messages
+        if self._summary_state is not None and before_date is None and after_date is None and around_date is None and _last_message_id is not None:
+            await self._summary_state.save_state(channel_id=ctx.channel.id, user_id=ctx.author.id, last_message_id=_last_message_id, summary=_summary_text)
+
+        await self._send_summary(ctx, _app_title, _summary_text, model, note=_note)
 
+    async def _send_summary(self, ctx, app_title, summary, model, note=None):
         # Send message in an embed format or in markdown file if it exceeds to 4096 characters
-        if len(_summary.text) > 4096:
+        if len(summary) > 4096:
             # Send the response as file
             response_file = f"{environ.get('TEMP_DIR')}/response{random.randint(8000,9000)}.md"
             async with aiofiles.open(response_file, "a+") as f:
-                await f.write(_app_title + "\n----------\n")
-                await f.write(_summary.text)
-            await ctx.respond(f"Here is the summary generated for this channel\n>✨ Model used: {model}", file=discord.File(response_file, "response.md"))
+                await f.write(app_title + "\n----------\n")
+                await f.write(summary)
+            _message = f"Here is the summary generated for this channel\n>✨ Model used: {model}"
+            await ctx.respond(f"{note}\n{_message}" if note else _message, file=discord.File(response_file, "response.md"))
         else:
             _embed = discord.Embed(
-                    title=_app_title,
-                    description=str(_summary.text),
+                    title=app_title,
+                    description=str(summary),
                     color=discord.Color.random()
             )
             _embed.set_author(name="Catch-up")
             _embed.set_footer(text="Responses generated by AI may not give accurate results! Double check with facts!")
             _embed.add_field(name="Model used", value=model, inline=False)
-            await ctx.respond(embed=_embed)
+            await ctx.respond(note, embed=_embed)
 
     # Handle errors
     @summarize.error
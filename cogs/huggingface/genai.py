@@ -1,12 +1,29 @@
+from core.huggingface.images import make_contact_sheet, transcode_image, upload_limit
+from core.huggingface.spaces import JobCancelled, JobCancelView
 from discord.ext import commands
-from gradio_client import Client
+from os import environ
 import asyncio
 import discord
-import gradio_client
+import io
+import random
+import weakref
 
 class HFGenAITools(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+
+        # Limits concurrent /imagine jobs per guild (or per user in DMs), jobs across the bot are limited per space by bot.hf_spaces
+        self._max_jobs_per_guild = int(environ.get("IMAGINE_MAX_JOBS_PER_GUILD", 2))
+        # Semaphores are only kept while a command holds or waits for them so idle guilds are dropped
+        self._guild_semaphores = weakref.WeakValueDictionary()
+
+    def _guild_semaphore(self, ctx) -> asyncio.Semaphore:
+        _key = ctx.guild.id if ctx.guild else ctx.author.id
+        _semaphore = self._guild_semaphores.get(_key)
+        if _semaphore is None:
+            _semaphore = asyncio.Semaphore(self._max_jobs_per_guild)
+            self._guild_semaphores[_key] = _semaphore
+        return _semaphore
         
     @commands.slash_command(
         contexts={discord.InteractionContextType.guild, discord.InteractionContextType.bot_dm},
@@ -38,41 +55,100 @@ class HFGenAITools(commands.Cog):
         description="Integer value to determine how the model follows your prompts",
         max_value=10
     )
+    @discord.option(
+        "count",
+        description="Number of variants to generate",
+        min_value=1,
+        max_value=4
+    )
+    @discord.option(
+        "contact_sheet",
+        description="Also send the variants combined in a single image"
+    )
     @discord.option(
         "private",
         description="A boolean value whether to send this image in public"
     )
     async def imagine(self, ctx, prompt: str, 
                             negative_prompt: str = None, width: int = 1024, height: int = 1024, 
-                            guidance_scale: int = 7, private: bool = False):
+                            guidance_scale: int = 7, count: int = 1, contact_sheet: bool = False, private: bool = False):
         """Generate images for free using Stable Diffusion 3 on HuggingFace"""
         await ctx.response.defer(ephemeral=private)
         
         # Default negative prompt to be appended
         _default_negative_prompt = "low quality, distorted, bad art, violence, sexually explicit, disturbing"
 
-        # Create image
+        # Create images, each variant uses a distinct seed and is sent as soon as it is ready
+        _view = JobCancelView(ctx.author.id, timeout=self.bot.hf_spaces.job_timeout)
+        _status_message = await ctx.respond(f"⌛ Generating {count} image{'s' if count > 1 else ''}...", view=_view, ephemeral=private)
+        _progress = {"done": 0}
+        _semaphore = self._guild_semaphore(ctx)
+        _max_bytes = upload_limit(ctx)
+
+        async def _status(status):
+            await _status_message.edit(content=f"{status} ({_progress['done']}/{count} done)" if count > 1 else status)
+
+        async def _generate(seed):
+            async with _semaphore:
+                _result = await self.bot.hf_spaces.submit(
+                    "stabilityai/stable-diffusion-3-medium",
+                    prompt=prompt,
+                    negative_prompt=f"{_default_negative_prompt}{', ' + negative_prompt if negative_prompt is not None else ' '}",
+                    width=width,
+                    height=height,
+                    guidance_scale=guidance_scale,
+                    seed=seed,
+                    randomize_seed=False,
+                    num_inference_steps=25,
+                    api_name="/infer",
+                    on_status=_status,
+                    cancelled=_view.cancelled
+                )
+            return await transcode_image(self.bot.executors, _result[0], max_bytes=_max_bytes)
+
+        _jobs = [asyncio.ensure_future(_generate(_seed)) for _seed in random.sample(range(2**31 - 1), count)]
+        _images = []
+        _errors = []
         try:
-            result = await asyncio.to_thread(
-                Client("stabilityai/stable-diffusion-3-medium").predict,
-                prompt=prompt,
-                negative_prompt=f"{_default_negative_prompt}{', ' + negative_prompt if negative_prompt is not None else ' '}",
-                width=width,
-                height=height,
-                guidance_scale=guidance_scale,
-                seed=0,
-                randomize_seed=True,
-                num_inference_steps=25,
-                api_name="/infer"
-            )
-        except gradio_client.exceptions.AppError as e:
-            raise e
+            for _job in asyncio.as_completed(_jobs):
+                try:
+                    _data, _extension = await _job
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    _errors.append(e)
+                    continue
+
+                _images.append(_data)
+                _progress["done"] += 1
+                if len(_images) == 1:
+                    _message = f"Hi, I am **Image generator**, I can help you create images, I see you wanted **{prompt}** so I created {'an image' if count == 1 else 'images'} for you. I hope you like {'it' if count == 1 else 'them'}!"
+                else:
+                    _message = f"Variant {len(_images)} of **{prompt}**"
+                await ctx.respond(_message, file=discord.File(fp=io.BytesIO(_data), filename=f"image_{len(_images)}.{_extension}"), ephemeral=private)
+        finally:
+            for _job in _jobs:
+                _job.cancel()
+            _view.stop()
+            await _status_message.delete()
+
+        if not _images:
+            raise _errors[0]
+        if _errors:
+            await ctx.respond(f"⚠️ {len(_errors)} of {count} variants failed to generate", ephemeral=private)
+
+        # Combine the variants in a grid
+        if contact_sheet and len(_images) > 1:
+            _sheet = await make_contact_sheet(self.bot.executors, _images, max_bytes=_max_bytes)
+            if _sheet is not None:
+                await ctx.respond(file=_sheet, ephemeral=private)
 
-        # Send the image
-        await ctx.respond(f"Hi, I am **Image generator**, I can help you create images, I see you wanted **{prompt}** so I created an image for you. I hope you like it!", file=discord.File(fp=result[0]))
-    
     @imagine.error
     async def on_application_command_error(self, ctx: discord.ApplicationContext, error: discord.DiscordException):
+        if isinstance(error, discord.ApplicationCommandInvokeError) and isinstance(error.original, JobCancelled):
+            await ctx.respond("✖️ Image generation was cancelled", ephemeral=True)
+            return
+
         await ctx.respond("⛔ I'm sorry but theres an internal error occured while generating an image. Please try again later")
 
 def setup(bot):
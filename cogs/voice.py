@@ -1,7 +1,13 @@
+from core.voice.player import PlayerController
+from core.voice.queue import QueueStore, TrackQueue
+from core.voice.track_cache import TrackResolver
 from discord.commands import SlashCommandGroup
 from discord.ext import commands
+from os import environ
 import asyncio
 import discord
+import itertools
+import logging
 import typing
 import wavelink
 
@@ -13,24 +19,213 @@ class Voice(commands.Cog):
         self.enqueued_tracks = {}
         self.pendings = {}
 
+        # guild id -> PlayerController
+        self.controllers = {}
+
+        # Shared across guilds so repeated searches skip Lavalink
+        self.track_resolver = TrackResolver()
+
+        # Optionally save the queues so they are restored after a restart
+        self._queue_store = QueueStore(environ.get("VOICE_QUEUE_STATE")) if environ.get("VOICE_QUEUE_STATE") else None
+        self._queues_restored = False
+
+        # guild id -> (reason, task) of a pending idle disconnect
+        self._idle_timeout = float(environ.get("VOICE_IDLE_TIMEOUT", 300))
+        self._empty_timeout = float(environ.get("VOICE_EMPTY_TIMEOUT", 60))
+        self._idle_timers = {}
+
+    def _idle_reason(self, guild: discord.Guild) -> str:
+        # Returns "empty" when nobody is listening, "idle" when there is nothing to play, otherwise None
+        _player = guild.voice_client
+        if _player is None or _player.channel is None:
+            return None
+        if not any(not _member.bot for _member in _player.channel.members):
+            return "empty"
+        if getattr(_player, "current", None) is None and not self.enqueued_tracks.get(guild.id):
+            return "idle"
+        return None
+
+    def _check_idle(self, guild: discord.Guild):
+        # Schedules, keeps or cancels the idle disconnect of the guild based on its current state
+        _reason = self._idle_reason(guild)
+        _pending = self._idle_timers.get(guild.id)
+        if _pending is not None:
+            if _pending[0] == _reason:
+                return
+            _pending[1].cancel()
+            self._idle_timers.pop(guild.id, None)
+
+        if _reason is not None:
+            self._idle_timers[guild.id] = (_reason, asyncio.create_task(self._reap_later(guild, _reason)))
+
+    async def _reap_later(self, guild: discord.Guild, reason: str):
+        await asyncio.sleep(self._empty_timeout if reason == "empty" else self._idle_timeout)
+        self._idle_timers.pop(guild.id, None)
+
+        # The state may have changed without an event (e.g. a track started from a restored queue)
+        if self._idle_reason(guild) != reason:
+            return
+
+        _controller = self.controllers.get(guild.id)
+        if _controller is not None:
+            await _controller.notify("👋 Left the voice channel since " + ("everyone left." if reason == "empty" else "there is nothing left to play."))
+
+        self.pendings.update({guild.id: "disconnecting"})
+        await self._cleanup(guild.id)
+        try:
+            await guild.voice_client.disconnect()
+        except Exception as e:
+            logging.warning("Voice: Failed to disconnect idle player in guild %s, reason: %s", guild.id, e)
+
+    async def _cleanup(self, guild_id: int, keep_queue: bool = False):
+        # Clear the enqueued tracks, the current user record and pending states of the guild
+        self._shutdown_controller(guild_id)
+        if not keep_queue:
+            self.enqueued_tracks.pop(guild_id, None)
+        self.current_user.pop(guild_id, None)
+        self.pendings.pop(guild_id, None)
+        _pending = self._idle_timers.pop(guild_id, None)
+        if _pending is not None and _pending[1] is not asyncio.current_task():
+            _pending[1].cancel()
+        self._save_queues()
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        # The bot was disconnected from the voice channel (e.g. kicked or /voice disconnect)
+        if member.id == self.bot.user.id:
+            if after.channel is None:
+                # The queue is kept when the player was disconnected by a closed Lavalink node, /voice play resumes it
+                await self._cleanup(member.guild.id, keep_queue=hasattr(self.bot, "voice_nodes") and self.bot.voice_nodes.node_lost(member.guild.id))
+            else:
+                self._check_idle(member.guild)
+            return
+
+        # Listeners joining or leaving the bot's channel
+        _player = member.guild.voice_client
+        if _player is not None and _player.channel is not None and _player.channel in (before.channel, after.channel):
+            self._check_idle(member.guild)
+
+    def _get_queue(self, guild_id: int) -> TrackQueue:
+        if guild_id not in self.enqueued_tracks:
+            self.enqueued_tracks[guild_id] = TrackQueue()
+        return self.enqueued_tracks[guild_id]
+
+    def _queue_state(self) -> dict:
+        # guild id -> voice and text channels, the track being played and the queue as encoded Lavalink tracks
+        _state = {}
+        for _guild_id, _queue in self.enqueued_tracks.items():
+            _guild = self.bot.get_guild(_guild_id)
+            _player = _guild.voice_client if _guild is not None else None
+            _controller = self.controllers.get(_guild_id)
+
+            _tracks = [[_user_id, _track.raw_data] for _user_id, _track in _queue]
+            if _player is not None and getattr(_player, "current", None) is not None and self.current_user.get(_guild_id) is not None:
+                _tracks.insert(0, [self.current_user[_guild_id], _player.current.raw_data])
+            if not _tracks:
+                continue
+
+            _state[str(_guild_id)] = {
+                "voice_channel_id": _player.channel.id if _player is not None else None,
+                "text_channel_id": _controller.text_channel.id if _controller is not None else None,
+                "tracks": _tracks
+            }
+        return _state
+
+    def _save_queues(self):
+        if self._queue_store is not None:
+            self._queue_store.schedule_save(self._queue_state)
+
+    @commands.Cog.listener()
+    async def on_wavelink_node_ready(self, payload: wavelink.NodeReadyEventPayload):
+        # Restore the saved queues once, and resume playback in voice channels that still have listeners
+        if self._queue_store is None or self._queues_restored:
+            return
+        self._queues_restored = True
+
+        for _guild_id, _saved in (await asyncio.to_thread(self._queue_store.load)).items():
+            _guild = self.bot.get_guild(int(_guild_id))
+            if _guild is None:
+                continue
+
+            _queue = self._get_queue(_guild.id)
+            for _user_id, _raw_data in _saved["tracks"]:
+                _queue.append(_user_id, wavelink.Playable(_raw_data))
+
+            _voice_channel = _guild.get_channel(_saved.get("voice_channel_id") or 0)
+            _text_channel = _guild.get_channel(_saved.get("text_channel_id") or 0)
+            if _voice_channel is None or _text_channel is None or _guild.voice_client is not None or not any(not _member.bot for _member in _voice_channel.members):
+                continue
+
+            try:
+                await _voice_channel.connect(cls=self.bot.voice_nodes.player_factory(_voice_channel))
+            except Exception as e:
+                logging.warning("Voice: Failed to resume playback in guild %s, reason: %s", _guild.id, e)
+                continue
+            await self._get_controller(_guild.id, _text_channel).advance()
+
+        logging.info("Voice: Restored the queues from %s", self._queue_store.path)
+
+    def _get_controller(self, guild_id: int, text_channel) -> PlayerController:
+        _controller = self.controllers.get(guild_id)
+        if _controller is None or _controller.closed:
+            _controller = PlayerController(self, guild_id, text_channel)
+            self.controllers[guild_id] = _controller
+        else:
+            _controller.text_channel = text_channel
+        return _controller
+
+    def _shutdown_controller(self, guild_id: int):
+        _controller = self.controllers.pop(guild_id, None)
+        if _controller is not None:
+            _controller.shutdown()
+
+    @commands.Cog.listener()
+    async def on_wavelink_track_end(self, payload: wavelink.TrackEndEventPayload):
+        # A replaced track is followed by the track that replaced it
+        if payload.player is None or payload.reason == "replaced":
+            return
+
+        _controller = self.controllers.get(payload.player.guild.id)
+        if _controller is not None:
+            await _controller.advance()
+            self._save_queues()
+
+        # Start the idle timer if the queue is done
+        self._check_idle(payload.player.guild)
+
+    @commands.Cog.listener()
+    async def on_wavelink_track_exception(self, payload: wavelink.TrackExceptionEventPayload):
+        # Lavalink ends the track afterwards, the queue is advanced on the track end event
+        logging.error("Voice: Track %s failed to play, reason: %s", payload.track.title, payload.exception)
+
+    @commands.Cog.listener()
+    async def on_wavelink_track_stuck(self, payload: wavelink.TrackStuckEventPayload):
+        # Skip the stuck track, the queue is advanced on the track end event
+        if payload.player is not None:
+            logging.warning("Voice: Track %s is stuck, skipping", payload.track.title)
+            await payload.player.skip(force=True)
+
     voice = SlashCommandGroup("voice", "Access voice features!", contexts={discord.InteractionContextType.guild})
 
     @voice.command()
     @discord.option(
         "search",
-        description="Search for a query or a YouTube URL to play",
+        description="Search for a query, a YouTube URL or a playlist URL to play",
         required=True
     )
     async def play(self, ctx, search: str):
-        """Play music or audio from YouTube, enter a search query or a YouTube URL to play"""
+        """Play music or audio from YouTube, enter a search query, a YouTube URL or a playlist URL to play"""
         await ctx.response.defer()
         vc = typing.cast(wavelink.Player, ctx.voice_client)
 
         try:
             if not vc:
-                vc = await ctx.author.voice.channel.connect(cls=wavelink.Player)
+                # The player is created on the least loaded Lavalink node
+                vc = await ctx.author.voice.channel.connect(cls=self.bot.voice_nodes.player_factory(ctx.author.voice.channel))
         except AttributeError:
             return await ctx.respond("🎙️ You must be in a voice channel to use this command.")
+        except wavelink.InvalidNodeException:
+            return await ctx.respond("⚠️ Playback is not available at the moment, please try again later.")
 
         # Check if there is a playback on the voice client, otherwise, clear the current user record
         #if self.current_user.get(ctx.guild.id) is not None and hasattr(vc, "playing") or hasattr(vc, "paused"):
@@ -44,9 +239,9 @@ class Voice(commands.Cog):
         if ctx.author.voice.channel.id != vc.channel.id:
             return await ctx.respond("🎙️ You must be in the same voice channel as the bot.")
 
-        # Search for tracks using the given query and assign it to the tracks variable
+        # Search for tracks using the given query and assign it to the tracks variable, recently resolved queries are served from the cache
         try:
-            tracks = await wavelink.Playable.search(search, source=wavelink.TrackSource.YouTube)
+            tracks, playlist = await self.track_resolver.resolve(search)
         except discord.ext.commands.errors.MissingRequiredArgument:
             await ctx.respond('⚠️ Please specify a search query.')
             return
@@ -55,40 +250,26 @@ class Voice(commands.Cog):
         if not tracks:
             await ctx.respond(f'❓ No tracks found with query: `{search}`')
             return
-        
-        # If there are tracks found, play the first search result
-        track = tracks[0]
 
-        # Initialize the enqueued tracks list
-        if not self.enqueued_tracks.get(ctx.guild.id):
-            self.enqueued_tracks.update({ctx.guild.id: []})
+        if playlist is not None:
+            # Enqueue every track of the playlist at once
+            self._get_queue(ctx.guild.id).extend(ctx.author.id, tracks)
+            await ctx.respond(f'➕ Added {len(tracks)} tracks from playlist: **{playlist}**')
+        else:
+            # If there are tracks found, play the first search result
+            track = tracks[0]
 
-        self.enqueued_tracks.get(ctx.guild.id).append({ctx.author.id: track})
-        await ctx.respond(f'➕ Added to tracks: **{track.title}**')
+            self._get_queue(ctx.guild.id).append(ctx.author.id, track)
+            await ctx.respond(f'➕ Added to tracks: **{track.title}**')
 
+        # Playback continues in the controller after this interaction ends
+        _controller = self._get_controller(ctx.guild.id, ctx.channel)
         if not vc.playing:
-            while self.enqueued_tracks.get(ctx.guild.id):
-                # Check if there is a pending shutdown state which is initiated at disconnect command
-                if self.pendings.get(ctx.guild.id) == "disconnecting":
-                    break
-
-                # Use two separate variables since popping the list will remove the first element and will cause errors
-                _now_playingby = self.enqueued_tracks.get(ctx.guild.id).pop(0)
-                _track = _now_playingby.get(list(_now_playingby)[0])
-
-                await ctx.send(f'▶️ Now playing track: **{_track.title}**')
-                await vc.play(_track)
-
-                # Temporarily save user id to check if the user is the one who queued the track
-                # For moral purposes
-
-                # Set the user currently playing the track to the class-level variable
-                self.current_user.update({ctx.guild.id: list(_now_playingby)[0]})
-
-                while vc.playing:
-                    await asyncio.sleep(1)
+            await _controller.advance()
         else:
             await ctx.respond(f'⌛ Waiting for the current track to finish playing...', ephemeral=True)
+        self._save_queues()
+        self._check_idle(ctx.guild)
 
     @voice.command()
     @discord.option(
@@ -107,7 +288,7 @@ class Voice(commands.Cog):
             await ctx.respond("❌ You are not playing any tracks!")
             return
 
-        user = await self.bot.fetch_user(self.current_user.get(ctx.guild.id))
+        user = await self.bot.entity_cache.get_user(self.current_user.get(ctx.guild.id))
         avatar_url = user.avatar.url if user.avatar else "https://cdn.discordapp.com/embed/avatars/0.png"
 
         _status_embed = discord.Embed(
@@ -148,9 +329,17 @@ class Voice(commands.Cog):
                 color=discord.Color.random()
             )
 
-            # We use list(track)[0] as it yields keys of the dictionary (casted to list) and we can get the user id
-            for track in self.enqueued_tracks.get(ctx.guild.id):
-                _queue_embed.add_field(name=track.get(list(track)[0]).title, value=f'{await self.bot.fetch_user(list(track)[0])}', inline=False)
+            # Embeds are limited to 25 fields, only the upcoming tracks are shown
+            _queue = self.enqueued_tracks.get(ctx.guild.id) or TrackQueue()
+            _upcoming = list(itertools.islice(_queue, 24))
+
+            # Resolve the requesters at once instead of fetching them one by one per track
+            _requesters = await self.bot.entity_cache.get_users([_user_id for _user_id, _ in _upcoming])
+            for _position, (_user_id, _track) in enumerate(_upcoming, start=1):
+                _queue_embed.add_field(name=f"{_position}. {_track.title}", value=f'{_requesters[_user_id]}', inline=False)
+
+            if len(_queue) > len(_upcoming):
+                _queue_embed.set_footer(text=f"and {len(_queue) - len(_upcoming)} more tracks")
 
             await ctx.respond(embed=_queue_embed)
 
@@ -168,32 +357,77 @@ class Voice(commands.Cog):
             return await ctx.respond('🎙️ Not currently connected to a voice channel.')
 
         # Check if enqueue tracks list is empty
-        if not self.enqueued_tracks.get(ctx.guild.id) or len(self.enqueued_tracks.get(ctx.guild.id)) == 0:
+        _queue = self.enqueued_tracks.get(ctx.guild.id)
+        if not _queue:
             return await ctx.respond('0️⃣ No tracks in the queue.')
-        
-        # Indicator where there is a skipped track
-        _tracks_skipped = False
 
-        # Check and iterate through the enqueued tracks list by the user, copy the list prevent direct reference and remove
-        for track in self.enqueued_tracks.get(ctx.guild.id).copy():
-            if list(track)[0] == ctx.author.id:
-                # Pop the track from the list
-                self.enqueued_tracks.get(ctx.guild.id).remove(track)
+        # Skip the next track or all tracks queued by the user
+        if skip_all:
+            _skipped = _queue.remove_all_by(ctx.author.id)
+            if not _skipped:
+                return await ctx.respond('🎵 You have no tracks in the queue.')
+            await ctx.respond('⏭️ Skipped all the tracks created by you in the queue.')
+        else:
+            _track = _queue.remove_next_by(ctx.author.id)
+            if _track is None:
+                return await ctx.respond('🎵 You have no tracks in the queue.')
+            await ctx.respond(f'⏭️ Skipped track: **{_track.title}**')
+
+        self._save_queues()
 
-                if not skip_all:
-                    await ctx.respond(f'⏭️ Skipped track: **{track.get(list(track)[0]).title}**')
-                
-                _tracks_skipped = True
+    @voice.command()
+    @discord.option(
+        "position",
+        description="Position of the track in the queue",
+        min_value=1
+    )
+    async def remove(self, ctx, position: int):
+        """Remove a track from the queue by its position"""
+        _queue = self.enqueued_tracks.get(ctx.guild.id)
+        if not _queue:
+            return await ctx.respond('0️⃣ No tracks in the queue.')
 
-                if not skip_all:
-                    break
-        
-        if not _tracks_skipped:
-            return await ctx.respond('🎵 You have no tracks in the queue.')
+        try:
+            _user_id, _track = _queue.get(position)
+        except IndexError:
+            return await ctx.respond(f'❓ There is no track at position {position}.')
 
-        # If the user skipped all the tracks
-        if skip_all:
-            await ctx.respond('⏭️ Skipped all the tracks created by you in the queue.')
+        # Only the user who queued the track, server administrator or the guild owner can remove it
+        if ctx.author.guild_permissions.administrator == False and ctx.guild.owner_id != ctx.author.id:
+            if _user_id != ctx.author.id:
+                return await ctx.respond('🛑 You are not the one who queued this track.')
+
+        _queue.remove(position)
+        self._save_queues()
+        await ctx.respond(f'🗑️ Removed track: **{_track.title}**')
+
+    @voice.command()
+    @discord.option(
+        "position",
+        description="Position of the track in the queue",
+        min_value=1
+    )
+    @discord.option(
+        "new_position",
+        description="New position of the track in the queue",
+        min_value=1
+    )
+    async def move(self, ctx, position: int, new_position: int):
+        """Move a track in the queue to another position (administrators only)"""
+        if ctx.author.guild_permissions.administrator == False and ctx.guild.owner_id != ctx.author.id:
+            return await ctx.respond('🛑 Only server administrators can reorder the queue.')
+
+        _queue = self.enqueued_tracks.get(ctx.guild.id)
+        if not _queue:
+            return await ctx.respond('0️⃣ No tracks in the queue.')
+
+        try:
+            _, _track = _queue.move(position, new_position)
+        except IndexError:
+            return await ctx.respond(f'❓ Positions must be between 1 and {len(_queue)}.')
+
+        self._save_queues()
+        await ctx.respond(f'↕️ Moved **{_track.title}** to position {new_position}.')
 
     @voice.command()
     async def ping(self, ctx):
@@ -297,16 +531,15 @@ class Voice(commands.Cog):
             # Store the title in the variable before stopping the track to notifiy the user since once it's stopped, vc.current.title will be None
             current_track_title = vc.current.title
 
-            # Set pending disconnect state
+            # Set pending disconnect state so the next track isn't played when this one stops
             self.pendings.update({ctx.guild.id: "disconnecting"})
+            self._shutdown_controller(ctx.guild.id)
 
             await vc.stop()
             await ctx.send(f'⏹️ Stopped track: **{current_track_title}**')
 
         # Clear the enqueued tracks list and the current user record
-        self.enqueued_tracks.pop(ctx.guild.id) if self.enqueued_tracks.get(ctx.guild.id) else None
-        self.current_user.pop(ctx.guild.id) if self.current_user.get(ctx.guild.id) else None
-        self.pendings.pop(ctx.guild.id) if self.pendings.get(ctx.guild.id) else None
+        await self._cleanup(ctx.guild.id)
 
         # Disconnect the bot from the voice channel
         await vc.disconnect()
@@ -1,20 +1,233 @@
+from collections import OrderedDict
+from pathlib import Path
 import google.generativeai as genai
+import hashlib
 import importlib
+import json
+import logging
 import os
+import re
+import threading
 
-# Import chromadb
+# Import chromadb, this is only required when using the chroma retrieval engine
 try:
     chromadb = importlib.import_module("chromadb")
+    _EmbeddingFunction = chromadb.EmbeddingFunction
 except ModuleNotFoundError:
-    raise ModuleNotFoundError("ChromaDB module isn't imported, I refuse to continue!")
+    chromadb = None
+    _EmbeddingFunction = object
 
-class GeminiDocumentRetrieval(chromadb.EmbeddingFunction):
-    def __call__(self, input: chromadb.Documents) -> chromadb.Embeddings: # type: ignore
-        model = 'models/text-embedding-004'
-        title = "Web Search Query"
-        genai.configure(api_key=os.environ.get("GOOGLE_AI_TOKEN"))
+# numpy is required for the on-disk embedding cache
+try:
+    numpy = importlib.import_module("numpy")
+except ModuleNotFoundError:
+    numpy = None
+
+# Content-hash keyed embedding cache with a memory LRU tier and an on-disk tier
+# The on-disk tier is a fixed capacity ring of memory-mapped float32 vectors and their content hashes, one per model
+class EmbeddingCache:
+    def __init__(self, model: str, cache_dir: str = None, memory_size: int = None, disk_size: int = None):
+        self.model = model
+        self._memory_size = memory_size if memory_size is not None else int(os.environ.get("EMBEDDINGS_CACHE_MEMORY_SIZE", 4096))
+        self._disk_size = disk_size if disk_size is not None else int(os.environ.get("EMBEDDINGS_CACHE_DISK_SIZE", 100000))
+        self._lock = threading.Lock()
+
+        # hash -> embedding
+        self._memory = OrderedDict()
+
+        # Version the on-disk tier by model name so switching models doesn't return stale vectors
+        self._disk_dir = None
+        _cache_dir = cache_dir if cache_dir is not None else os.environ.get("EMBEDDINGS_CACHE_DIR", ".cache/embeddings")
+        if numpy is not None and self._disk_size > 0 and _cache_dir:
+            self._disk_dir = Path(_cache_dir) / re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+        self._vectors = None
+        # Content hash of each slot, written alongside the vectors so the index can be rebuilt on load
+        self._keys = None
+        # hash -> slot
+        self._index = {}
+        self._next_slot = 0
+        self._dirty = False
+
+        # Statistics
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self._disk_dir is not None:
+            try:
+                self._load_disk()
+            except Exception as e:
+                logging.warning("EmbeddingCache: Cannot load the on-disk cache at %s, starting empty, reason: %s", self._disk_dir, e)
+                self._vectors, self._keys, self._index, self._next_slot = None, None, {}, 0
+
+    @staticmethod
+    def key(text: str, task_type: str, title: str = None) -> str:
+        return hashlib.sha1(f"{task_type}\0{title or ''}\0{text}".encode("utf-8")).hexdigest()
+
+    def _load_disk(self):
+        _meta_file = self._disk_dir / "meta.json"
+        if not _meta_file.exists():
+            return
+
+        with open(_meta_file, "r") as f:
+            _meta = json.load(f)
+
+        if _meta["capacity"] != self._disk_size:
+            # Capacity changed, the ring layout is no longer valid
+            return
+
+        self._vectors = numpy.memmap(self._disk_dir / "vectors.f32", dtype=numpy.float32, mode="r+", shape=(_meta["capacity"], _meta["dimensions"]))
+        self._keys = numpy.memmap(self._disk_dir / "keys.bin", dtype=numpy.uint8, mode="r+", shape=(_meta["capacity"], 20))
+        self._index = {_hash.tobytes().hex(): _slot for _slot, _hash in enumerate(self._keys) if _hash.any()}
+        self._next_slot = _meta["next_slot"]
+
+    def _create_disk(self, dimensions: int):
+        self._disk_dir.mkdir(parents=True, exist_ok=True)
+        self._vectors = numpy.memmap(self._disk_dir / "vectors.f32", dtype=numpy.float32, mode="w+", shape=(self._disk_size, dimensions))
+        self._keys = numpy.memmap(self._disk_dir / "keys.bin", dtype=numpy.uint8, mode="w+", shape=(self._disk_size, 20))
+        self._index = {}
+        self._next_slot = 0
+
+    def _remember(self, key, embedding):
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+
+            if self._vectors is not None and key in self._index:
+                _embedding = self._vectors[self._index[key]].tolist()
+                self._remember(key, _embedding)
+                self.disk_hits += 1
+                return _embedding
+
+            self.misses += 1
+            return None
+
+    def put(self, key, embedding):
+        with self._lock:
+            self._remember(key, embedding)
+
+            if self._disk_dir is None:
+                return
 
-        return genai.embed_content(model=model,
-                                    content=input,
+            if self._vectors is None:
+                self._create_disk(len(embedding))
+            elif len(embedding) != self._vectors.shape[1]:
+                return
+
+            # Overwrite the oldest slot when the ring is full
+            if key in self._index:
+                _slot = self._index[key]
+            else:
+                _slot = self._next_slot
+                if self._keys[_slot].any():
+                    self._index.pop(self._keys[_slot].tobytes().hex(), None)
+                self._next_slot = (self._next_slot + 1) % self._disk_size
+
+            self._vectors[_slot] = embedding
+            self._keys[_slot] = numpy.frombuffer(bytes.fromhex(key), dtype=numpy.uint8)
+            self._index[key] = _slot
+            self._dirty = True
+
+    def flush(self):
+        with self._lock:
+            if self._vectors is None or not self._dirty:
+                return
+
+            self._vectors.flush()
+            self._keys.flush()
+
+            # Write the metadata atomically so a crash doesn't leave a corrupted file
+            _tmp_file = self._disk_dir / "meta.json.tmp"
+            with open(_tmp_file, "w") as f:
+                json.dump({
+                    "model": self.model,
+                    "capacity": self._disk_size,
+                    "dimensions": self._vectors.shape[1],
+                    "next_slot": self._next_slot
+                }, f)
+            os.replace(_tmp_file, self._disk_dir / "meta.json")
+            self._dirty = False
+
+    def stats(self) -> dict:
+        _lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "model": self.model,
+            "memory_entries": len(self._memory),
+            "disk_entries": len(self._index),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / _lookups if _lookups else 0,
+            # Every hit is an embedding that didn't need to be sent to the API
+            "saved_embeddings": self.memory_hits + self.disk_hits
+        }
+
+# Shared caches by model name
+_embedding_caches = {}
+_embedding_caches_lock = threading.Lock()
+
+def get_embedding_cache(model: str) -> EmbeddingCache:
+    with _embedding_caches_lock:
+        if model not in _embedding_caches:
+            _embedding_caches[model] = EmbeddingCache(model)
+        return _embedding_caches[model]
+
+def get_embedding_caches() -> dict:
+    with _embedding_caches_lock:
+        return dict(_embedding_caches)
+
+class GeminiDocumentRetrieval(_EmbeddingFunction):
+    model = 'models/text-embedding-004'
+    title = "Web Search Query"
+
+    # Maximum number of documents per embedding request
+    batch_size = 100
+
+    def __call__(self, input): # type: ignore
+        _cache = get_embedding_cache(self.model)
+        _keys = [EmbeddingCache.key(_document, "retrieval_document", self.title) for _document in input]
+        _embeddings = [_cache.get(_key) for _key in _keys]
+
+        # Only embed the documents that are not cached, in batches instead of one request per document
+        _missing = [_index for _index, _embedding in enumerate(_embeddings) if _embedding is None]
+        if _missing:
+            genai.configure(api_key=os.environ.get("GOOGLE_AI_TOKEN"))
+
+        _saved_calls = -(-len(input) // self.batch_size) - (-(-len(_missing) // self.batch_size))
+        for _offset in range(0, len(_missing), self.batch_size):
+            _batch = _missing[_offset:_offset + self.batch_size]
+            for _index, _embedding in zip(_batch, genai.embed_content(model=self.model,
+                                    content=[input[_index] for _index in _batch],
                                     task_type="retrieval_document",
-                                    title=title)["embedding"]
+                                    title=self.title)["embedding"]):
+                _embeddings[_index] = _embedding
+                _cache.put(_keys[_index], _embedding)
+
+        if _missing:
+            _cache.flush()
+
+        logging.info("GeminiDocumentRetrieval: %d of %d embeddings cached, %d embedding requests saved, cache stats: %s", len(input) - len(_missing), len(input), _saved_calls, _cache.stats())
+        return _embeddings
+
+    def embed_query(self, query: str):
+        _cache = get_embedding_cache(self.model)
+        _key = EmbeddingCache.key(query, "retrieval_query")
+        _embedding = _cache.get(_key)
+        if _embedding is not None:
+            return _embedding
+
+        genai.configure(api_key=os.environ.get("GOOGLE_AI_TOKEN"))
+
+        _embedding = genai.embed_content(model=self.model,
+                                    content=query,
+                                    task_type="retrieval_query")["embedding"]
+        _cache.put(_key, _embedding)
+        return _embedding
@@ -0,0 +1,105 @@
+from os import environ
+from pathlib import Path
+import aiofiles
+import aiofiles.os
+import aiohttp
+import asyncio
+import discord
+import google.generativeai as genai
+import logging
+import mimetypes
+import os
+import tempfile
+
+# Raised when the File API fails to process an uploaded file
+class FileProcessingFailed(ValueError):
+    pass
+
+# Media ingestion pipeline for multimodal prompts
+# Downloads Discord attachments with bounded concurrency and uploads them to the Gemini File API concurrently
+class MediaPipeline:
+    def __init__(self):
+        self._max_file_size = int(environ.get("MEDIA_MAX_FILE_SIZE", 50 * 1024 * 1024))
+        self._download_semaphore = asyncio.Semaphore(int(environ.get("MEDIA_MAX_CONCURRENT_DOWNLOADS", 4)))
+        self._session: aiohttp.ClientSession = None
+
+    def _get_session(self):
+        # Reuse the HTTP connections across downloads
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30))
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    @staticmethod
+    def mime_type(attachment: discord.Attachment) -> str:
+        # Discord doesn't label every file (e.g. many code and text files), guess those from the file extension
+        # None if unknown, the File API then decides whether the file is supported
+        if attachment.content_type:
+            return attachment.content_type.split(";")[0].strip()
+        return mimetypes.guess_type(attachment.filename)[0]
+
+    def check_attachment(self, attachment: discord.Attachment):
+        # Raises ValueError if the attachment cannot be used as a prompt
+        if attachment.size > self._max_file_size:
+            raise ValueError(f"{attachment.filename} exceeds the maximum file size of {self._max_file_size // (1024 * 1024)}MB")
+
+    async def download(self, attachment: discord.Attachment, filepath: str):
+        async with self._download_semaphore:
+            async with self._get_session().get(attachment.url, allow_redirects=True) as _response:
+                _response.raise_for_status()
+
+                # Write to file while enforcing the size limit, the attachment size can't be fully trusted
+                _size = 0
+                async with aiofiles.open(filepath, "wb") as _file:
+                    async for _chunk in _response.content.iter_chunked(65536):
+                        _size += len(_chunk)
+                        if _size > self._max_file_size:
+                            raise ValueError(f"{attachment.filename} exceeds the maximum file size of {self._max_file_size // (1024 * 1024)}MB")
+                        await _file.write(_chunk)
+
+    async def upload(self, filepath: str, mime_type: str = None, display_name: str = None, on_processing = None):
+        _file = await asyncio.to_thread(genai.upload_file, path=filepath, mime_type=mime_type, display_name=display_name or filepath.split("/")[-1])
+
+        # Wait for the file to be processed
+        _notified = False
+        while _file.state.name == "PROCESSING":
+            if on_processing is not None and not _notified:
+                await on_processing()
+                _notified = True
+            await asyncio.sleep(3)
+            _file = await asyncio.to_thread(genai.get_file, _file.name)
+
+        if _file.state.name == "FAILED":
+            raise FileProcessingFailed(f"The file {display_name or filepath.split('/')[-1]} could not be processed")
+
+        return _file
+
+    async def ingest(self, attachment: discord.Attachment, prefix: str = "JAKEY", on_processing = None):
+        # Downloads and uploads a single attachment, returns the File API file
+        self.check_attachment(attachment)
+
+        # Unique file name in TEMP_DIR as attachments with the same file name can be ingested concurrently
+        _fd, _filepath = tempfile.mkstemp(prefix=f"{prefix}.", suffix=f".{attachment.filename}", dir=environ.get("TEMP_DIR"))
+        os.close(_fd)
+        try:
+            await self.download(attachment, _filepath)
+            return await self.upload(_filepath, mime_type=self.mime_type(attachment), display_name=attachment.filename, on_processing=on_processing)
+        finally:
+            # Ensure no data persists even on failure
+            if Path(_filepath).exists():
+                await aiofiles.os.remove(_filepath)
+
+    async def ingest_many(self, attachments: list, prefix: str = "JAKEY"):
+        # Attachments are processed concurrently so it takes as long as the largest file, failed ones are skipped
+        _results = await asyncio.gather(*[self.ingest(_attachment, prefix=prefix) for _attachment in attachments], return_exceptions=True)
+
+        _files = []
+        for _attachment, _result in zip(attachments, _results):
+            if isinstance(_result, Exception):
+                logging.warning("MediaPipeline: I cannot upload or attach %s, reason %s", _attachment.filename, _result)
+                continue
+            _files.append(_result)
+        return _files
@@ -0,0 +1,102 @@
+from collections import Counter
+from core.ai.embeddings import GeminiDocumentRetrieval
+import asyncio
+import math
+import numpy
+import re
+
+# In-memory Okapi BM25 index used as a lexical pre-filter before semantic ranking
+class BM25Index:
+    _TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+    def __init__(self, documents: list, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+        self._term_frequencies = [Counter(self.tokenize(_document)) for _document in documents]
+        self._lengths = [sum(_tf.values()) for _tf in self._term_frequencies]
+        self._average_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0
+
+        # Number of documents containing each term
+        _document_frequencies = Counter()
+        for _tf in self._term_frequencies:
+            _document_frequencies.update(_tf.keys())
+
+        _count = len(documents)
+        self._idf = {_term: math.log(1 + (_count - _df + 0.5) / (_df + 0.5)) for _term, _df in _document_frequencies.items()}
+
+    @classmethod
+    def tokenize(cls, text: str) -> list:
+        return cls._TOKEN_PATTERN.findall(text.lower())
+
+    def scores(self, query: str) -> list:
+        _query_terms = [_term for _term in set(self.tokenize(query)) if _term in self._idf]
+        _scores = []
+        for _tf, _length in zip(self._term_frequencies, self._lengths):
+            _score = 0.0
+            _norm = self.k1 * (1 - self.b + self.b * _length / (self._average_length or 1))
+            for _term in _query_terms:
+                _frequency = _tf.get(_term, 0)
+                if _frequency:
+                    _score += self._idf[_term] * _frequency * (self.k1 + 1) / (_frequency + _norm)
+            _scores.append(_score)
+        return _scores
+
+    def top_n(self, query: str, n: int) -> list:
+        # Indices of the n best scoring documents, in their original order
+        _scores = self.scores(query)
+        return sorted(sorted(range(len(_scores)), key=lambda _index: _scores[_index], reverse=True)[:n])
+
+# In-process retrieval engine, ranks document chunks against a query with cosine similarity
+# All chunks are embedded in batched calls and ranked in a single pass without an external vector database
+class VectorRanker:
+    def __init__(self, embedding_function: GeminiDocumentRetrieval = None):
+        self._embedding_function = embedding_function if embedding_function is not None else GeminiDocumentRetrieval()
+
+    async def rank(self, query: str, documents: dict, top_k: int = 10, candidates: int = None) -> dict:
+        # documents is a dictionary of source (e.g. URL) -> list of chunks
+        # Returns source -> up to top_k chunks sorted by relevance
+        # If candidates is set, only the best BM25 scoring chunks of each source are embedded and re-ranked (hybrid retrieval)
+        if candidates is not None:
+            documents = self.prefilter(query, documents, candidates)
+
+        _sources = [_source for _source, _chunks in documents.items() for _ in _chunks]
+        _chunks = [_chunk for _chunks in documents.values() for _chunk in _chunks]
+        if len(_chunks) == 0:
+            return {}
+
+        _document_embeddings, _query_embedding = await asyncio.gather(
+            asyncio.to_thread(self._embedding_function, _chunks),
+            asyncio.to_thread(self._embedding_function.embed_query, query)
+        )
+
+        return self.top_k(
+            numpy.asarray(_document_embeddings, dtype=numpy.float32),
+            numpy.asarray(_query_embedding, dtype=numpy.float32),
+            _sources, _chunks, top_k
+        )
+
+    @staticmethod
+    def prefilter(query: str, documents: dict, candidates: int) -> dict:
+        _filtered = {}
+        for _source, _chunks in documents.items():
+            if len(_chunks) <= candidates:
+                _filtered[_source] = _chunks
+                continue
+            _filtered[_source] = [_chunks[_index] for _index in BM25Index(_chunks).top_n(query, candidates)]
+        return _filtered
+
+    @staticmethod
+    def top_k(document_embeddings, query_embedding, sources: list, chunks: list, top_k: int = 10) -> dict:
+        # Cosine similarity of every chunk against the query
+        _document_norms = numpy.linalg.norm(document_embeddings, axis=1)
+        _document_norms[_document_norms == 0] = 1
+        _scores = (document_embeddings @ query_embedding) / (_document_norms * (numpy.linalg.norm(query_embedding) or 1))
+
+        # Sort once by score and pick the top k of each source while preserving the ranking
+        _results = {}
+        for _index in numpy.argsort(-_scores, kind="stable"):
+            _ranked = _results.setdefault(sources[_index], [])
+            if len(_ranked) < top_k:
+                _ranked.append(chunks[_index])
+        return _results
@@ -0,0 +1,62 @@
+# Measures the recall of hybrid retrieval (BM25 pre-filter + semantic re-ranking) against the
+# embed-everything baseline on the fixed offline corpus in data/retrieval_eval.yaml, used to tune WEB_HYBRID_CANDIDATES
+#
+# Usage (from the project root, requires GOOGLE_AI_TOKEN in dev.env):
+#   python -m core.ai.retrieval_eval [candidates ...] [--top-k K]
+from core.ai.embeddings import GeminiDocumentRetrieval
+from core.ai.retrieval import VectorRanker
+from dotenv import load_dotenv
+import argparse
+import numpy
+import yaml
+
+def evaluate(corpus: list, candidates_list: list, top_k: int, embedding_function = None):
+    _embedding_function = embedding_function if embedding_function is not None else GeminiDocumentRetrieval()
+
+    # candidates -> (recall sum, embedded chunks, total chunks)
+    _results = {_candidates: [0.0, 0, 0] for _candidates in candidates_list}
+    for _entry in corpus:
+        _query, _documents = _entry["query"], _entry["documents"]
+
+        # Embed every chunk once, the hybrid rankings reuse the same embeddings
+        _sources = [_source for _source, _chunks in _documents.items() for _ in _chunks]
+        _chunks = [_chunk for _chunks in _documents.values() for _chunk in _chunks]
+        _embeddings = numpy.asarray(_embedding_function(_chunks), dtype=numpy.float32)
+        _query_embedding = numpy.asarray(_embedding_function.embed_query(_query), dtype=numpy.float32)
+        _positions = {(_source, _chunk): _index for _index, (_source, _chunk) in enumerate(zip(_sources, _chunks))}
+
+        _baseline = VectorRanker.top_k(_embeddings, _query_embedding, _sources, _chunks, top_k)
+        _relevant = {(_source, _chunk) for _source, _ranked in _baseline.items() for _chunk in _ranked}
+
+        for _candidates in candidates_list:
+            _filtered = VectorRanker.prefilter(_query, _documents, _candidates)
+            _indices = [_positions[(_source, _chunk)] for _source, _chunks in _filtered.items() for _chunk in _chunks]
+            _hybrid = VectorRanker.top_k(_embeddings[_indices], _query_embedding, [_sources[_i] for _i in _indices], [_chunks[_i] for _i in _indices], top_k)
+            _retrieved = {(_source, _chunk) for _source, _ranked in _hybrid.items() for _chunk in _ranked}
+
+            _results[_candidates][0] += len(_relevant & _retrieved) / len(_relevant) if _relevant else 1
+            _results[_candidates][1] += len(_indices)
+            _results[_candidates][2] += len(_chunks)
+
+    return {
+        _candidates: {
+            "recall": _recall / len(corpus),
+            "embedded_ratio": _embedded / _total if _total else 0
+        }
+        for _candidates, (_recall, _embedded, _total) in _results.items()
+    }
+
+if __name__ == "__main__":
+    load_dotenv("dev.env")
+
+    _parser = argparse.ArgumentParser(description="Measure hybrid retrieval recall against the embed-everything baseline")
+    _parser.add_argument("candidates", type=int, nargs="*", default=[3, 5, 8, 10])
+    _parser.add_argument("--top-k", type=int, default=3)
+    _parser.add_argument("--corpus", default="data/retrieval_eval.yaml")
+    _args = _parser.parse_args()
+
+    with open(_args.corpus, "r") as f:
+        _corpus = yaml.safe_load(f)
+
+    for _candidates, _metrics in evaluate(_corpus, _args.candidates, _args.top_k).items():
+        print(f"candidates={_candidates}: recall@{_args.top_k}={_metrics['recall']:.3f}, embedded {_metrics['embedded_ratio']:.1%} of chunks")
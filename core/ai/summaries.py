@@ -0,0 +1,41 @@
+from os import environ
+import motor.motor_asyncio
+import time
+
+# A class that is responsible for persisting rolling per-channel summaries generated by /summarize
+# So subsequent summaries only need to read the messages sent after the last summarized message
+# Summaries are personalized for the user who requested them, so the state is kept per channel and user
+class SummaryState:
+    def __init__(self, db_conn: motor.motor_asyncio.AsyncIOMotorClient = None):
+        self._db_conn = db_conn
+
+        if db_conn is None:
+            raise ConnectionError("Please set MONGO_DB_URL in dev.env")
+
+        # Use the same database as the chat history
+        self._db = self._db_conn[environ.get("MONGO_DB_NAME", "chat_history_prod")]
+
+        # _discord_channel_summaries collection
+        self._collection = self._db["_discord_channel_summaries"]
+
+    async def load_state(self, channel_id, user_id):
+        if channel_id is None or not isinstance(channel_id, int):
+            raise TypeError("channel_id is required")
+
+        # Returns None if the channel has not been summarized for the user yet
+        return await self._collection.find_one({"channel_id": channel_id, "user_id": user_id})
+
+    async def save_state(self, channel_id, user_id, last_message_id, summary):
+        if channel_id is None or not isinstance(channel_id, int):
+            raise TypeError("channel_id is required")
+
+        await self._collection.update_one({"channel_id": channel_id, "user_id": user_id}, {
+            "$set": {
+                "channel_id": channel_id,
+                "user_id": user_id,
+                "last_message_id": last_message_id,
+                "summary": summary,
+                # Unix timestamp, used to determine if the rolling summary is too old to be extended
+                "updated_at": time.time()
+            }
+        }, upsert=True)
@@ -0,0 +1,79 @@
+import re
+
+# Compact transcript format of Discord messages used for summarization prompts
+# Authors are listed once in a table and messages are referenced by short ids (a1, m1)
+# so metadata such as usernames, IDs and jump URLs aren't repeated on every message
+class CompactTranscript:
+    # Matches markdown links pointing to message short ids e.g. [**X** said something](m3)
+    _REFERENCE_PATTERN = re.compile(r"\]\((m\d+)\)")
+
+    def __init__(self, guild_id, channel_id):
+        self._guild_id = guild_id
+        self._channel_id = channel_id
+
+        # Discord user ID -> (short id, author row)
+        self._authors = {}
+        # Discord message ID -> short id
+        self._message_ids = {}
+        # short id -> Discord message ID used to reconstruct jump links
+        self._short_ids = {}
+        self._lines = []
+        self._last_date = None
+
+    def add_message(self, message):
+        # Author table row
+        if message.author.id not in self._authors:
+            _author_short_id = f"a{len(self._authors) + 1}"
+            self._authors[message.author.id] = (_author_short_id, f"{_author_short_id}={message.author.name}|{message.author.display_name}|{message.author.id}")
+        _author_short_id = self._authors[message.author.id][0]
+
+        _message_short_id = f"m{len(self._message_ids) + 1}"
+        self._message_ids[message.id] = _message_short_id
+        self._short_ids[_message_short_id] = message.id
+
+        # Only emit the date when it changes
+        if message.created_at.date() != self._last_date:
+            self._last_date = message.created_at.date()
+            self._lines.append(f"#{self._last_date.isoformat()}")
+
+        # Replies are resolved when encoding since the replied message may be added later
+        self._lines.append((
+            f"{_message_short_id} {_author_short_id} {message.created_at.strftime('%H:%M')}",
+            message.reference.message_id if message.reference is not None else None,
+            f" +{len(message.attachments)}file" if message.attachments else "",
+            # Indent multi-line messages instead of repeating the header
+            message.content.replace("\n", "\n  ")
+        ))
+
+    def encode(self):
+        _messages = []
+        for _line in self._lines:
+            if isinstance(_line, str):
+                _messages.append(_line)
+                continue
+
+            _header, _reply_id, _attachments, _body = _line
+            # Replies referencing messages within the transcript
+            if _reply_id in self._message_ids:
+                _header += f" >{self._message_ids[_reply_id]}"
+            _messages.append(f"{_header}{_attachments}: {_body}")
+
+        return "\n".join([
+            "AUTHORS (short id=username|display name|user id):",
+            *[_row for _, _row in self._authors.values()],
+            "MESSAGES (message id, author id, UTC time, >replied message, +attachments: body):",
+            *_messages
+        ])
+
+    def jump_url(self, short_id):
+        return f"https://discord.com/channels/{self._guild_id}/{self._channel_id}/{self._short_ids[short_id]}"
+
+    def expand_references(self, text):
+        # Replace message short ids used as link targets with their jump links, unknown ids are left as is
+        return self._REFERENCE_PATTERN.sub(
+            lambda match: f"]({self.jump_url(match.group(1))})" if match.group(1) in self._short_ids else match.group(0),
+            text
+        )
+
+    def __len__(self):
+        return len(self._message_ids)
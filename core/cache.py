@@ -0,0 +1,79 @@
+from collections import OrderedDict
+import asyncio
+import time
+import weakref
+
+# Registry of named caches, used to report cache sizes for diagnostics
+_caches = weakref.WeakValueDictionary()
+
+def get_caches():
+    return dict(_caches)
+
+# Bounded LRU cache with per-entry expiry, this is meant to be used within the event loop (not thread safe)
+class TTLCache:
+    def __init__(self, name, ttl: float = 300, max_size: int = 1024):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+
+        # key -> (expires at, value)
+        self._data = OrderedDict()
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+        _caches[name] = self
+
+    def get(self, key, default=None):
+        _entry = self._data.get(key)
+        if _entry is None or _entry[0] < time.monotonic():
+            if _entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return _entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        self._data[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+        self._data.move_to_end(key)
+
+        # Evict the least recently used entries
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        _entry = self._data.pop(key, None)
+        return _entry[1] if _entry is not None else default
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        _entry = self._data.get(key)
+        return _entry is not None and _entry[0] >= time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
+
+# Coalesces concurrent calls with the same key into one in-flight task (single-flight)
+# Every caller awaits the same result or exception
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, coro_func, *args, **kwargs):
+        _task = self._inflight.get(key)
+        if _task is None:
+            _task = asyncio.ensure_future(coro_func(*args, **kwargs))
+            self._inflight[key] = _task
+            _task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # Shield the shared task so one caller being cancelled doesn't cancel it for the others
+        return await asyncio.shield(_task)
+
+    def __len__(self):
+        return len(self._inflight)
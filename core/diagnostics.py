@@ -0,0 +1,208 @@
+from collections import Counter, deque
+from os import environ
+import asyncio
+import io
+import ipaddress
+import os
+import tracemalloc
+import weakref
+
+# Measures event loop lag by how late a periodic sleep wakes up
+# Blocking calls on the event loop show up as lag spikes, samples cover the last LOOP_LAG_SAMPLES intervals
+# Also records when tasks are created so long running tasks can be reported
+class LoopLagMonitor:
+    def __init__(self):
+        self.interval = float(environ.get("LOOP_LAG_INTERVAL", 0.5))
+        self._samples = deque(maxlen=int(environ.get("LOOP_LAG_SAMPLES", 1200)))
+        self._task = None
+
+        # task -> loop time when the task was created (or first seen for tasks created before the monitor started)
+        self._task_created = weakref.WeakKeyDictionary()
+
+    def start(self):
+        # Safe to call more than once (on_ready can fire again after a gateway reconnect)
+        if self._task is not None and not self._task.done():
+            return
+
+        _loop = asyncio.get_running_loop()
+        for _task in asyncio.all_tasks(_loop):
+            self._task_created.setdefault(_task, _loop.time())
+
+        # Wrap the current task factory to record creation times
+        _previous_factory = _loop.get_task_factory()
+
+        def _task_factory(loop, coro, **kwargs):
+            _task = _previous_factory(loop, coro, **kwargs) if _previous_factory is not None else asyncio.Task(coro, loop=loop, **kwargs)
+            self._task_created[_task] = loop.time()
+            return _task
+
+        if not getattr(_previous_factory, "_loop_lag_monitor", False):
+            _task_factory._loop_lag_monitor = True
+            _loop.set_task_factory(_task_factory)
+
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        _loop = asyncio.get_running_loop()
+        while True:
+            _started = _loop.time()
+            await asyncio.sleep(self.interval)
+            self._samples.append(max(0, _loop.time() - _started - self.interval))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def lag_stats(self) -> dict:
+        # Lag percentiles in milliseconds
+        _samples = sorted(self._samples)
+        if not _samples:
+            return {"samples": 0}
+
+        def _percentile(percent):
+            return round(_samples[min(len(_samples) - 1, int(len(_samples) * percent / 100))] * 1000, 2)
+
+        return {
+            "samples": len(_samples),
+            "window_seconds": round(len(_samples) * self.interval),
+            "p50_ms": _percentile(50),
+            "p95_ms": _percentile(95),
+            "p99_ms": _percentile(99),
+            "max_ms": round(_samples[-1] * 1000, 2),
+            "last_ms": round(self._samples[-1] * 1000, 2)
+        }
+
+    def task_age(self, task: asyncio.Task) -> float:
+        # Seconds since the task was created, None if the task was never seen
+        _created = self._task_created.get(task)
+        return asyncio.get_running_loop().time() - _created if _created is not None else None
+
+def task_name(task: asyncio.Task) -> str:
+    _coro = task.get_coro()
+    return getattr(_coro, "__qualname__", None) or type(_coro).__name__
+
+def task_stack(task: asyncio.Task, limit: int = 10) -> str:
+    _output = io.StringIO()
+    task.print_stack(limit=limit, file=_output)
+    return _output.getvalue()
+
+def tasks_report(monitor: LoopLagMonitor = None, limit: int = 10, stacks: int = 3) -> str:
+    # Tasks grouped by coroutine, the longest running tasks and their stacks
+    _tasks = [_task for _task in asyncio.all_tasks() if _task is not asyncio.current_task()]
+    _lines = [f"{len(_tasks)} tasks", "", "Most numerous:"]
+    for _name, _count in Counter(task_name(_task) for _task in _tasks).most_common(limit):
+        _lines.append(f"  {_count:>6}  {_name}")
+
+    if monitor is not None:
+        _aged = sorted(
+            ((monitor.task_age(_task), _task) for _task in _tasks if monitor.task_age(_task) is not None),
+            key=lambda _item: _item[0],
+            reverse=True
+        )[:limit]
+        _lines += ["", "Longest running:"]
+        for _age, _task in _aged:
+            _lines.append(f"  {_age:>9.1f}s  {task_name(_task)} ({_task.get_name()})")
+
+        for _age, _task in _aged[:stacks]:
+            _lines += ["", f"Stack of {task_name(_task)} ({_task.get_name()}):", task_stack(_task).rstrip()]
+
+    return "\n".join(_lines)
+
+def _read_tcp_sockets() -> dict:
+    # socket inode -> (local address, remote address, state) from /proc/self/net/tcp and tcp6
+    _states = {"01": "ESTABLISHED", "02": "SYN_SENT", "06": "TIME_WAIT", "07": "CLOSE", "08": "CLOSE_WAIT", "0A": "LISTEN"}
+    _sockets = {}
+    for _file in ("tcp", "tcp6"):
+        try:
+            with open(f"/proc/self/net/{_file}", "r") as f:
+                _rows = f.readlines()[1:]
+        except OSError:
+            continue
+
+        for _row in _rows:
+            _fields = _row.split()
+            _addresses = []
+            for _address in _fields[1:3]:
+                # Addresses are hex in host byte order per 32-bit word
+                _host, _port = _address.split(":")
+                _packed = b"".join(bytes.fromhex(_host[_index:_index + 8])[::-1] for _index in range(0, len(_host), 8))
+                _addresses.append(f"{ipaddress.ip_address(_packed)}:{int(_port, 16)}")
+            _sockets[_fields[9]] = (_addresses[0], _addresses[1], _states.get(_fields[3], _fields[3]))
+    return _sockets
+
+def fds_report(limit: int = 50) -> str:
+    # Open file descriptors by kind and the TCP connections of the process (Linux only)
+    try:
+        _fds = os.listdir("/proc/self/fd")
+    except OSError as e:
+        return f"Cannot list open file descriptors: {e}"
+
+    _kinds = Counter()
+    _socket_inodes = []
+    for _fd in _fds:
+        try:
+            _target = os.readlink(f"/proc/self/fd/{_fd}")
+        except OSError:
+            continue
+
+        if _target.startswith("socket:["):
+            _kinds["socket"] += 1
+            _socket_inodes.append(_target[8:-1])
+        elif _target.startswith("pipe:["):
+            _kinds["pipe"] += 1
+        elif _target.startswith("anon_inode:"):
+            _kinds[_target] += 1
+        else:
+            _kinds["file"] += 1
+
+    _lines = [f"{len(_fds)} open file descriptors"] + [f"  {_count:>6}  {_kind}" for _kind, _count in _kinds.most_common()]
+
+    _tcp_sockets = _read_tcp_sockets()
+    _connections = [_tcp_sockets[_inode] for _inode in _socket_inodes if _inode in _tcp_sockets]
+    _lines += ["", f"{len(_connections)} TCP sockets, by remote address:"]
+    for (_remote, _state), _count in Counter((_remote, _state) for _, _remote, _state in _connections).most_common(limit):
+        _lines.append(f"  {_count:>6}  {_remote} {_state}")
+    return "\n".join(_lines)
+
+# tracemalloc snapshots, each snapshot is compared to the previous one to find what keeps growing
+class MemoryProfiler:
+    def __init__(self):
+        self._previous = None
+        # One snapshot at a time since each snapshot is compared to the previous one
+        self._lock = asyncio.Lock()
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._previous = None
+
+    def stop(self):
+        tracemalloc.stop()
+        self._previous = None
+
+    async def snapshot(self, limit: int = 15) -> str:
+        # Taking and comparing snapshots of a large heap is slow, it runs in a thread so the event loop keeps running
+        async with self._lock:
+            return await asyncio.to_thread(self._snapshot, limit)
+
+    def _snapshot(self, limit: int) -> str:
+        # Top allocations by line and the difference since the previous snapshot
+        _snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>")
+        ))
+        _current, _peak = tracemalloc.get_traced_memory()
+        _lines = [f"Traced memory: {_current / 1024 / 1024:.1f} MiB (peak {_peak / 1024 / 1024:.1f} MiB)", "", "Top allocations:"]
+        _lines += [f"  {_stat}" for _stat in _snapshot.statistics("lineno")[:limit]]
+
+        if self._previous is not None:
+            _lines += ["", "Difference since the previous snapshot:"]
+            _lines += [f"  {_stat}" for _stat in _snapshot.compare_to(self._previous, "lineno")[:limit]]
+
+        self._previous = _snapshot
+        return "\n".join(_lines)
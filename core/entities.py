@@ -0,0 +1,63 @@
+from core.cache import SingleFlight, TTLCache
+from os import environ
+import asyncio
+import discord
+
+# Bot-wide cache of Discord users and members
+# Lookups consult the gateway cache first, then the TTL cache, and concurrent REST fetches for the same ID are coalesced
+class EntityCache:
+    def __init__(self, bot: discord.Bot):
+        self.bot = bot
+
+        _ttl = float(environ.get("ENTITY_CACHE_TTL", 600))
+        self._users = TTLCache("discord_users", ttl=_ttl, max_size=4096)
+        # (guild id, user id) -> discord.Member
+        self._members = TTLCache("discord_members", ttl=_ttl, max_size=4096)
+        self._flights = SingleFlight()
+
+        # Invalidate stale entries when Discord tells us they changed
+        bot.add_listener(self._on_member_update, "on_member_update")
+        bot.add_listener(self._on_member_remove, "on_member_remove")
+        bot.add_listener(self._on_user_update, "on_user_update")
+
+    async def get_user(self, user_id: int) -> discord.User:
+        _user = self.bot.get_user(user_id)
+        if _user is not None:
+            return _user
+
+        _user = self._users.get(user_id)
+        if _user is not None:
+            return _user
+
+        _user = await self._flights.do(("user", user_id), self.bot.fetch_user, user_id)
+        self._users.set(user_id, _user)
+        return _user
+
+    async def get_member(self, guild: discord.Guild, user_id: int) -> discord.Member:
+        _member = guild.get_member(user_id)
+        if _member is not None:
+            return _member
+
+        _member = self._members.get((guild.id, user_id))
+        if _member is not None:
+            return _member
+
+        _member = await self._flights.do(("member", guild.id, user_id), guild.fetch_member, user_id)
+        self._members.set((guild.id, user_id), _member)
+        return _member
+
+    async def get_users(self, user_ids) -> dict:
+        # Resolve unique user IDs concurrently and return them as user id -> discord.User
+        _user_ids = list(dict.fromkeys(user_ids))
+        return dict(zip(_user_ids, await asyncio.gather(*[self.get_user(_user_id) for _user_id in _user_ids])))
+
+    async def _on_member_update(self, before: discord.Member, after: discord.Member):
+        self._members.pop((after.guild.id, after.id))
+
+    async def _on_member_remove(self, member: discord.Member):
+        self._members.pop((member.guild.id, member.id))
+
+    async def _on_user_update(self, before: discord.User, after: discord.User):
+        self._users.pop(after.id)
+        for _guild in after.mutual_guilds:
+            self._members.pop((_guild.id, after.id))
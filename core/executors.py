@@ -0,0 +1,127 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from os import environ
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import time
+
+# Instrumentation of an executor pool
+class _PoolStats:
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.total_wait_time = 0.0
+        self.total_run_time = 0.0
+        self.max_run_time = 0.0
+
+    def as_dict(self):
+        _finished = self.completed + self.failed
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "avg_wait_ms": round(self.total_wait_time / _finished * 1000, 2) if _finished else 0,
+            "avg_run_ms": round(self.total_run_time / _finished * 1000, 2) if _finished else 0,
+            "max_run_ms": round(self.max_run_time * 1000, 2)
+        }
+
+# Shared executor service to keep CPU heavy work off the event loop
+# A process pool is used for pure-CPU work (arguments and results must be picklable) and a thread pool for work that releases the GIL
+# Submissions beyond the workers and the queue size wait for a free slot so the pools can't be flooded
+class Executors:
+    def __init__(self):
+        _cpu_count = os.cpu_count() or 2
+        self._process_workers = int(environ.get("EXECUTOR_PROCESS_WORKERS", max(1, min(_cpu_count - 1, 4))))
+        self._thread_workers = int(environ.get("EXECUTOR_THREAD_WORKERS", min(32, _cpu_count + 4)))
+        _max_queue = int(environ.get("EXECUTOR_MAX_QUEUE", 64))
+
+        self._thread_pool = ThreadPoolExecutor(max_workers=self._thread_workers, thread_name_prefix="jakey-executor")
+        # Created by start(), CPU work runs in the thread pool until then
+        self._process_pool = None
+
+        self._process_slots = asyncio.Semaphore(self._process_workers + _max_queue)
+        self._thread_slots = asyncio.Semaphore(self._thread_workers + _max_queue)
+
+        self._process_stats = _PoolStats("process", self._process_workers, _max_queue)
+        self._thread_stats = _PoolStats("thread", self._thread_workers, _max_queue)
+
+    def start(self):
+        # Forks the process pool workers, this must be called before any threads are started or clients are created (at the top of main.py)
+        # since forking a multithreaded process (e.g. with gRPC channels) can deadlock the workers
+        # Fork so workers don't re-run main.py, platforms without fork fall back to the thread pool
+        if self._process_pool is not None or "fork" not in multiprocessing.get_all_start_methods():
+            return
+
+        self._process_pool = ProcessPoolExecutor(max_workers=self._process_workers, mp_context=multiprocessing.get_context("fork"))
+        # Workers are forked on the first submission, do it now while the process is still single threaded
+        self._process_pool.submit(int).result()
+
+    async def _run(self, pool, slots, stats, func, *args, **kwargs):
+        stats.submitted += 1
+        stats.queued += 1
+        _queued_at = time.perf_counter()
+        _waiting = True
+        try:
+            async with slots:
+                _waiting = False
+                stats.queued -= 1
+                stats.in_flight += 1
+                _started_at = time.perf_counter()
+                stats.total_wait_time += _started_at - _queued_at
+                try:
+                    _result = await asyncio.get_running_loop().run_in_executor(pool, functools.partial(func, *args, **kwargs))
+                except Exception:
+                    stats.failed += 1
+                    raise
+                finally:
+                    _run_time = time.perf_counter() - _started_at
+                    stats.total_run_time += _run_time
+                    stats.max_run_time = max(stats.max_run_time, _run_time)
+                    stats.in_flight -= 1
+
+                stats.completed += 1
+                return _result
+        finally:
+            # Cancelled while waiting for a slot
+            if _waiting:
+                stats.queued -= 1
+
+    async def run_cpu(self, func, *args, **kwargs):
+        _pool = self._process_pool
+        if _pool is None:
+            return await self.run_thread(func, *args, **kwargs)
+
+        try:
+            return await self._run(_pool, self._process_slots, self._process_stats, func, *args, **kwargs)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OOM killer), the pool is not recreated as forking the now multithreaded process is unsafe
+            logging.error("Executors: The process pool is broken, CPU heavy work will run in the thread pool until restarted")
+            self._process_pool = None
+            raise
+
+    async def run_thread(self, func, *args, **kwargs):
+        return await self._run(self._thread_pool, self._thread_slots, self._thread_stats, func, *args, **kwargs)
+
+    def stats(self) -> dict:
+        return {
+            "process": self._process_stats.as_dict(),
+            "thread": self._thread_stats.as_dict()
+        }
+
+    def shutdown(self):
+        self._thread_pool.shutdown(wait=False, cancel_futures=True)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,144 @@
+from os import environ
+from pathlib import Path
+import aiofiles.os
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+# Output formats that the spliced audio can be encoded to, other formats (or formats ffmpeg can't encode) are spliced into WAV
+_SPLICE_FORMATS = ("flac", "mp3", "ogg", "opus", "wav")
+
+# Window of an audio file around the region being edited, decoded locally to mono at the sample rate the space expects
+# Only the window is uploaded and the edited window is spliced back into the original audio with splice()
+class AudioWindow:
+    def __init__(self, source: str, path: str, offset: float, duration: float, total_duration: float, sample_rate: int, channels: int, edit_start: float, edit_length: float):
+        self.source = source
+        self.path = path
+        self.offset = offset
+        # Start of the edit region relative to the window
+        self.edit_start = edit_start
+        # Length of the edit region, shortened when the requested region goes past the end of the audio
+        self.edit_length = edit_length
+        self.duration = duration
+        self.total_duration = total_duration
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    async def cleanup(self):
+        try:
+            await aiofiles.os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def _temp_path(prefix: str, suffix: str) -> str:
+    # Unique file in TEMP_DIR, ffmpeg overwrites it
+    _fd, _path = tempfile.mkstemp(prefix=prefix, suffix=suffix, dir=environ.get("TEMP_DIR", "temp"))
+    os.close(_fd)
+    return _path
+
+def is_available() -> bool:
+    return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+
+async def _run(*args, timeout: float = None) -> bytes:
+    _process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        _stdout, _stderr = await asyncio.wait_for(_process.communicate(), timeout=timeout or float(environ.get("FFMPEG_TIMEOUT", 60)))
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        _process.kill()
+        await _process.wait()
+        raise
+
+    if _process.returncode != 0:
+        raise RuntimeError(f"{args[0]} exited with code {_process.returncode}: {_stderr.decode(errors='replace').strip()[-500:]}")
+    return _stdout
+
+async def probe(source: str) -> dict:
+    # Duration, sample rate and channels of the first audio stream, source can be a file path or URL
+    _output = json.loads(await _run(
+        "ffprobe", "-v", "error", "-select_streams", "a:0",
+        "-show_entries", "stream=sample_rate,channels:format=duration",
+        "-of", "json", source
+    ))
+    _stream = _output["streams"][0]
+    return {
+        "duration": float(_output["format"]["duration"]),
+        "sample_rate": int(_stream["sample_rate"]),
+        "channels": int(_stream["channels"])
+    }
+
+async def cut_window(source: str, start: float, length: float, max_window: float = None) -> AudioWindow:
+    # Decodes [start - padding, start + length + padding] of the source, bounded by max_window seconds
+    # The seek happens before decoding so remote sources are only partially downloaded when the server supports range requests
+    _sample_rate = int(environ.get("EZAUDIO_SAMPLE_RATE", 24000))
+    _max_window = max_window if max_window is not None else float(environ.get("EZAUDIO_MAX_WINDOW", 10))
+
+    _info = await probe(source)
+    _start = min(max(0, start), _info["duration"])
+    _length = min(length, _info["duration"] - _start)
+    if _length <= 0:
+        raise ValueError("The edit region is outside of the audio")
+
+    # Spread the remaining window evenly as context before and after the edit region
+    _padding = max(0, (_max_window - _length) / 2)
+    _offset = max(0, _start - _padding)
+    _end = min(_info["duration"], _start + _length + _padding)
+
+    _path = _temp_path("ezaudio.window.", ".wav")
+    try:
+        await _run(
+            "ffmpeg", "-v", "error", "-y",
+            "-ss", f"{_offset:.3f}", "-t", f"{_end - _offset:.3f}", "-i", source,
+            "-ac", "1", "-ar", str(_sample_rate), "-c:a", "pcm_s16le", _path
+        )
+    except BaseException:
+        await aiofiles.os.remove(_path)
+        raise
+    return AudioWindow(source, _path, _offset, _end - _offset, _info["duration"], _info["sample_rate"], _info["channels"], _start - _offset, _length)
+
+async def splice(window: AudioWindow, edited_path: str, output_format: str = "wav") -> str:
+    # Replaces the window in the original audio with the edited audio, returns the path of the spliced file
+    # Segments are resampled to the original sample rate and channel count so they can be concatenated
+    _output_format = output_format.lower() if output_format.lower() in _SPLICE_FORMATS else "wav"
+    _layout = "mono" if window.channels == 1 else "stereo"
+    _format = f"aresample={window.sample_rate},aformat=sample_rates={window.sample_rate}:channel_layouts={_layout},asetpts=PTS-STARTPTS"
+
+    # (input, trim) of each segment in order, the original audio is split when it is used on both sides of the window
+    _segments = []
+    if window.offset > 0:
+        _segments.append(("original", f"atrim=end={window.offset:.3f}"))
+    _segments.append(("edited", f"atrim=end={window.duration:.3f}"))
+    if window.offset + window.duration < window.total_duration:
+        _segments.append(("original", f"atrim=start={window.offset + window.duration:.3f}"))
+
+    _original_inputs = [f"[o{_index}]" for _index, (_input, _) in enumerate(_segments) if _input == "original"]
+    _filters = [f"[0:a]asplit={len(_original_inputs)}{''.join(_original_inputs)}"] if _original_inputs else []
+    for _index, (_input, _trim) in enumerate(_segments):
+        _filters.append(f"{f'[o{_index}]' if _input == 'original' else '[1:a]'}{_trim},{_format}[s{_index}]")
+    _filters.append(f"{''.join(f'[s{_index}]' for _index in range(len(_segments)))}concat=n={len(_segments)}:v=0:a=1[out]")
+
+    # The encoder for the format may be missing from the ffmpeg build (e.g. libmp3lame), WAV is always available
+    for _format in dict.fromkeys((_output_format, "wav")):
+        _path = _temp_path("ezaudio.edited.", f".{_format}")
+        try:
+            await _run(
+                "ffmpeg", "-v", "error", "-y",
+                "-i", window.source, "-i", edited_path,
+                "-filter_complex", ";".join(_filters), "-map", "[out]", _path
+            )
+            return _path
+        except RuntimeError as e:
+            await aiofiles.os.remove(_path)
+            if _format == "wav":
+                raise
+            logging.warning("EzAudio: Failed to encode the spliced audio as %s, falling back to WAV, reason: %s", _format, e)
+        except BaseException:
+            await aiofiles.os.remove(_path)
+            raise
+
+# Output format of the spliced audio based on the source's file name or URL
+def output_format(filename: str) -> str:
+    _suffix = Path(filename.split("?")[0]).suffix.lstrip(".").lower()
+    return _suffix if _suffix in _SPLICE_FORMATS else "wav"
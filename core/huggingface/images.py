@@ -0,0 +1,119 @@
+from os import environ
+from pathlib import Path
+import aiofiles.os
+import discord
+import importlib
+import io
+import logging
+import math
+
+# Pillow format names and file extensions of the supported output formats
+_FORMATS = {
+    "webp": ("WEBP", "webp"),
+    "jpeg": ("JPEG", "jpg"),
+    "jpg": ("JPEG", "jpg")
+}
+
+# Discord's default upload limit, used in DMs and outside of guilds
+DEFAULT_UPLOAD_LIMIT = 10 * 1024 * 1024
+
+def _transcode(path: str, output_format: str, quality: int, max_bytes: int) -> tuple:
+    # Runs in a worker, returns (data, extension)
+    try:
+        Image = importlib.import_module("PIL.Image")
+    except ModuleNotFoundError:
+        Image = None
+
+    if Image is None or output_format not in _FORMATS:
+        # Send the original file as is
+        with open(path, "rb") as f:
+            _data = f.read()
+        if len(_data) > max_bytes:
+            raise ValueError(f"The image is {len(_data)} bytes which exceeds the upload limit of {max_bytes} bytes")
+        return _data, Path(path).suffix.lstrip(".") or "png"
+
+    _format, _extension = _FORMATS[output_format]
+    with Image.open(path) as _source:
+        # JPEG has no alpha channel, WebP keeps it
+        _image = _source.copy() if _source.mode == "RGB" or (_format == "WEBP" and _source.mode == "RGBA") else _source.convert("RGB")
+
+    return _encode(Image, _image, _format, quality, max_bytes), _extension
+
+def _encode(Image, image, image_format: str, quality: int, max_bytes: int) -> bytes:
+    # Quality is lowered first, then the image is downscaled until it fits within max_bytes
+    _quality = quality
+    while True:
+        _buffer = io.BytesIO()
+        if image_format == "WEBP":
+            image.save(_buffer, format=image_format, quality=_quality, method=4)
+        else:
+            image.save(_buffer, format=image_format, quality=_quality, optimize=True)
+        if _buffer.tell() <= max_bytes:
+            return _buffer.getvalue()
+
+        if _quality > 50:
+            _quality = max(50, _quality - 15)
+        elif min(image.size) > 256:
+            image = image.resize((int(image.width * 0.75), int(image.height * 0.75)), Image.LANCZOS)
+        else:
+            raise ValueError(f"The image could not be compressed below the upload limit of {max_bytes} bytes")
+
+def _contact_sheet(images: list, output_format: str, quality: int, max_bytes: int, tile_size: int = 512) -> tuple:
+    # Runs in a worker, lays out the images in a grid and returns (data, extension)
+    Image = importlib.import_module("PIL.Image")
+
+    _tiles = []
+    for _data in images:
+        with Image.open(io.BytesIO(_data)) as _source:
+            _tile = _source.convert("RGB")
+            _tile.thumbnail((tile_size, tile_size), Image.LANCZOS)
+            _tiles.append(_tile)
+
+    _columns = math.ceil(math.sqrt(len(_tiles)))
+    _rows = math.ceil(len(_tiles) / _columns)
+    _cell_width, _cell_height = max(_tile.width for _tile in _tiles), max(_tile.height for _tile in _tiles)
+
+    _sheet = Image.new("RGB", (_columns * _cell_width, _rows * _cell_height), (0, 0, 0))
+    for _index, _tile in enumerate(_tiles):
+        _sheet.paste(_tile, ((_index % _columns) * _cell_width, (_index // _columns) * _cell_height))
+
+    _format, _extension = _FORMATS.get(output_format, _FORMATS["webp"])
+    return _encode(Image, _sheet, _format, quality, max_bytes), _extension
+
+# Transcodes a generated image off the event loop (WebP or JPEG at IMAGE_OUTPUT_QUALITY) and enforces the upload limit, returns (data, extension)
+# The source file is always deleted
+async def transcode_image(executors, path: str, max_bytes: int = DEFAULT_UPLOAD_LIMIT) -> tuple:
+    _output_format = environ.get("IMAGE_OUTPUT_FORMAT", "webp").lower()
+    _quality = int(environ.get("IMAGE_OUTPUT_QUALITY", 85))
+
+    try:
+        return await executors.run_cpu(_transcode, path, _output_format, _quality, max_bytes)
+    finally:
+        try:
+            await aiofiles.os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning("transcode_image: Failed to remove %s, reason: %s", path, e)
+
+# Same as transcode_image but returns a discord.File read from memory
+async def prepare_image(executors, path: str, filename: str = "image", max_bytes: int = DEFAULT_UPLOAD_LIMIT) -> discord.File:
+    _data, _extension = await transcode_image(executors, path, max_bytes)
+    return discord.File(fp=io.BytesIO(_data), filename=f"{filename}.{_extension}")
+
+# Composes images (as bytes) into a single grid image off the event loop, returns None if Pillow is not installed
+async def make_contact_sheet(executors, images: list, filename: str = "contact_sheet", max_bytes: int = DEFAULT_UPLOAD_LIMIT) -> discord.File:
+    try:
+        importlib.import_module("PIL.Image")
+    except ModuleNotFoundError:
+        return None
+
+    _data, _extension = await executors.run_cpu(
+        _contact_sheet, images,
+        environ.get("IMAGE_OUTPUT_FORMAT", "webp").lower(), int(environ.get("IMAGE_OUTPUT_QUALITY", 85)), max_bytes
+    )
+    return discord.File(fp=io.BytesIO(_data), filename=f"{filename}.{_extension}")
+
+# Upload limit of the context's guild
+def upload_limit(ctx) -> int:
+    return ctx.guild.filesize_limit if getattr(ctx, "guild", None) else DEFAULT_UPLOAD_LIMIT
@@ -0,0 +1,150 @@
+from core.cache import SingleFlight
+from os import environ
+import asyncio
+import discord
+import importlib
+import itertools
+import logging
+
+# Raised when a job is cancelled by the user
+class JobCancelled(Exception):
+    pass
+
+# Cancel button attached to the status message of a running job, only the user who started the job can press it
+class JobCancelView(discord.ui.View):
+    def __init__(self, owner_id: int, timeout: float = None):
+        super().__init__(timeout=timeout)
+        self.owner_id = owner_id
+        self.cancelled = asyncio.Event()
+
+    @discord.ui.button(label="Cancel", style=discord.ButtonStyle.secondary, emoji="✖️")
+    async def cancel(self, button: discord.ui.Button, interaction: discord.Interaction):
+        if interaction.user.id != self.owner_id:
+            await interaction.response.send_message("Only the person who started this can cancel it", ephemeral=True)
+            return
+
+        self.cancelled.set()
+        button.disabled = True
+        await interaction.response.edit_message(content="✖️ Cancelling...", view=self)
+
+# Pool of warm gradio clients per Hugging Face space
+# Creating a client fetches the space config over the network so clients are created once and reused across calls
+# Jobs are submitted with the client's job API, the number of concurrent jobs per space is bounded and their status is reported while waiting
+class SpacesClientPool:
+    def __init__(self):
+        self._clients_per_space = int(environ.get("HF_SPACES_CLIENTS_PER_SPACE", 1))
+        self._max_jobs = int(environ.get("HF_SPACES_MAX_JOBS_PER_SPACE", 2))
+        self._job_timeout = float(environ.get("HF_SPACES_JOB_TIMEOUT", 300))
+        self._poll_interval = float(environ.get("HF_SPACES_POLL_INTERVAL", 3))
+        self._hf_token = environ.get("HF_TOKEN") or None
+
+        # space -> list of clients and the round robin iterator over them
+        self._clients = {}
+        self._next_client = {}
+        # space -> job slots
+        self._semaphores = {}
+        # Concurrent requests for a cold space share one client handshake
+        self._connecting = SingleFlight()
+
+    @property
+    def job_timeout(self) -> float:
+        return self._job_timeout
+
+    def _semaphore(self, space: str) -> asyncio.Semaphore:
+        if space not in self._semaphores:
+            self._semaphores[space] = asyncio.Semaphore(self._max_jobs)
+        return self._semaphores[space]
+
+    async def _connect(self, space: str):
+        gradio_client = importlib.import_module("gradio_client")
+        _client = await asyncio.to_thread(gradio_client.Client, space, hf_token=self._hf_token, verbose=False)
+        self._clients.setdefault(space, []).append(_client)
+        self._next_client[space] = itertools.cycle(list(self._clients[space]))
+        return _client
+
+    async def get_client(self, space: str):
+        if len(self._clients.get(space, [])) < self._clients_per_space:
+            return await self._connecting.do(space, self._connect, space)
+        return next(self._next_client[space])
+
+    def invalidate(self, space: str, client):
+        # Drop a client that failed, e.g. after the space restarted, a new one is created on the next call
+        if client in self._clients.get(space, []):
+            self._clients[space].remove(client)
+            self._next_client[space] = itertools.cycle(list(self._clients[space]))
+
+    @staticmethod
+    def describe_status(status) -> str:
+        # Human readable status of a gradio job
+        _code = getattr(status.code, "name", str(status.code))
+        if _code == "IN_QUEUE":
+            _position = f"position {status.rank + 1}" if status.rank is not None else "waiting"
+            _queue_size = f" of {status.queue_size}" if status.queue_size else ""
+            _eta = f", about {round(status.eta)} seconds left" if status.eta else ""
+            return f"⌛ In the queue, {_position}{_queue_size}{_eta}"
+        if _code in ("PROCESSING", "ITERATING", "PROGRESS"):
+            if status.progress_data:
+                _progress = status.progress_data[-1]
+                if _progress.index is not None and _progress.length:
+                    return f"⚙️ Processing... {_progress.index}/{_progress.length} {_progress.unit or 'steps'}"
+            return "⚙️ Processing..."
+        return "⌛ Starting..."
+
+    async def _wait(self, job, on_status, cancelled: asyncio.Event):
+        _future = asyncio.wrap_future(job)
+        _cancel_wait = asyncio.ensure_future(cancelled.wait()) if cancelled is not None else None
+        _last_status = None
+        _deadline = asyncio.get_running_loop().time() + self._job_timeout
+        try:
+            while True:
+                _remaining = _deadline - asyncio.get_running_loop().time()
+                if _remaining <= 0:
+                    raise asyncio.TimeoutError(f"The job did not finish within {round(self._job_timeout)} seconds")
+
+                _done, _ = await asyncio.wait(
+                    [_task for _task in (_future, _cancel_wait) if _task is not None],
+                    timeout=min(self._poll_interval, _remaining),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if _future in _done:
+                    return _future.result()
+                if _cancel_wait is not None and _cancel_wait in _done:
+                    raise JobCancelled("The job was cancelled")
+
+                # Report the queue position and progress when it changes
+                if on_status is not None:
+                    _status = self.describe_status(job.status())
+                    if _status != _last_status:
+                        _last_status = _status
+                        await on_status(_status)
+        except BaseException:
+            # Leave the space queue, including when the calling task is cancelled
+            job.cancel()
+            raise
+        finally:
+            if _cancel_wait is not None:
+                _cancel_wait.cancel()
+
+    async def submit(self, space: str, *args, api_name: str, on_status = None, cancelled: asyncio.Event = None, **kwargs):
+        # on_status is an async callable receiving a status message while the job is queued or running
+        # cancelled is an event that cancels the job when set (e.g. JobCancelView.cancelled)
+        _semaphore = self._semaphore(space)
+        if _semaphore.locked() and on_status is not None:
+            await on_status("⌛ Waiting for other generations to finish...")
+
+        async with _semaphore:
+            if cancelled is not None and cancelled.is_set():
+                raise JobCancelled("The job was cancelled")
+
+            _client = await self.get_client(space)
+            try:
+                _job = _client.submit(*args, api_name=api_name, **kwargs)
+                return await self._wait(_job, on_status, cancelled)
+            except (JobCancelled, asyncio.TimeoutError, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                # Errors raised by the space itself don't mean the client is broken
+                if type(e).__name__ != "AppError":
+                    logging.warning("SpacesClientPool: Discarding the client of %s, reason: %s", space, e)
+                    self.invalidate(space, _client)
+                raise
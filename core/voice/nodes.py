@@ -0,0 +1,207 @@
+from os import environ
+import asyncio
+import functools
+import logging
+import time
+import wavelink
+import yaml
+
+# Manages a pool of Lavalink nodes
+# Nodes are connected in the background so an unreachable node doesn't block startup or disable playback,
+# new players are placed on the least loaded node (preferring nodes serving the voice channel's region),
+# players are moved to another node as soon as their node's websocket drops (while they are still attached to it)
+# and lost nodes are reconnected by a health check
+class NodeManager:
+    def __init__(self, bot):
+        self.bot = bot
+        self._health_interval = float(environ.get("VOICE_NODE_HEALTH_INTERVAL", 30))
+        self._retries = int(environ.get("VOICE_NODE_RETRIES", 3))
+
+        # identifier -> node config
+        self._configs = {_config["identifier"]: _config for _config in self._load_configs()}
+        # identifier -> latest stats of the node, used for placement
+        self._stats = {}
+        self._health_task = None
+        self._connecting = {}
+        # guild id -> when its player was disconnected by a closed node
+        self._lost_guilds = {}
+
+        bot.add_listener(self.on_wavelink_node_ready)
+        bot.add_listener(self.on_wavelink_node_disconnected)
+        bot.add_listener(self.on_wavelink_node_closed)
+
+    @staticmethod
+    def _load_configs() -> list:
+        # Multiple nodes are configured in a YAML file, see _wavelink/nodes.yml.template
+        _path = environ.get("ENV_LAVALINK_NODES_CONFIG")
+        if _path:
+            with open(_path, "r") as f:
+                _nodes = yaml.safe_load(f) or []
+            return [{
+                "identifier": str(_node.get("identifier", f"node{_index}")),
+                "uri": _node["uri"],
+                "password": str(_node.get("password", "youshallnotpass")),
+                "regions": [str(_region).lower() for _region in _node.get("regions", [])]
+            } for _index, _node in enumerate(_nodes)]
+
+        # Single node configured with environment variables
+        return [{
+            "identifier": environ.get("ENV_LAVALINK_IDENTIFIER") or "main",
+            "uri": environ.get("ENV_LAVALINK_URI") or "http://127.0.0.1:2222",
+            "password": environ.get("ENV_LAVALINK_PASS") or "youshallnotpass",
+            "regions": []
+        }]
+
+    async def _connect(self, identifier: str):
+        _config = self._configs[identifier]
+        try:
+            # Eject the previous node with the same identifier before connecting again
+            # Closing a node disconnects its players, so they are moved first and the node is kept if some can't be moved
+            _previous = wavelink.Pool.nodes.get(identifier)
+            if _previous is not None:
+                if _previous.players:
+                    await self._move_players(_previous, list(_previous.players.values()))
+                if _previous.players:
+                    logging.warning("NodeManager: Not reconnecting Lavalink node %s, its players could not be moved", identifier)
+                    return
+                await _previous.close(eject=True)
+
+            await wavelink.Pool.connect(
+                client=self.bot,
+                nodes=[wavelink.Node(identifier=identifier, uri=_config["uri"], password=_config["password"], retries=self._retries)]
+            )
+        except Exception as e:
+            logging.error("NodeManager: Failed to connect to Lavalink node %s, reason: %s", identifier, e)
+
+    def _schedule_connect(self, identifier: str):
+        _task = self._connecting.get(identifier)
+        if _task is None or _task.done():
+            self._connecting[identifier] = asyncio.create_task(self._connect(identifier))
+
+    def start(self):
+        # Safe to call more than once (on_ready can fire again after a gateway reconnect)
+        if self._health_task is not None and not self._health_task.done():
+            return
+
+        for _identifier in self._configs:
+            self._schedule_connect(_identifier)
+        self._health_task = asyncio.create_task(self._health_check())
+
+    async def _health_check(self):
+        while True:
+            await asyncio.sleep(self._health_interval)
+            for _identifier in self._configs:
+                _node = wavelink.Pool.nodes.get(_identifier)
+                if _node is None or _node.status == wavelink.NodeStatus.DISCONNECTED:
+                    self._stats.pop(_identifier, None)
+                    self._schedule_connect(_identifier)
+                    continue
+
+                if _node.status == wavelink.NodeStatus.CONNECTED:
+                    await self._fetch_stats(_node)
+
+            # Players left on a lost node when no other node was available at the time
+            _stranded = {}
+            for _player in self.bot.voice_clients:
+                if isinstance(_player, wavelink.Player) and _player.connected and _player.node.status != wavelink.NodeStatus.CONNECTED:
+                    _stranded.setdefault(_player.node.identifier, (_player.node, []))[1].append(_player)
+            for _node, _players in _stranded.values():
+                await self._move_players(_node, _players)
+
+            # Forget old node losses
+            for _guild_id, _lost_at in list(self._lost_guilds.items()):
+                if time.monotonic() - _lost_at > self._health_interval:
+                    del self._lost_guilds[_guild_id]
+
+    async def _fetch_stats(self, node: wavelink.Node):
+        try:
+            self._stats[node.identifier] = await node.fetch_stats()
+        except Exception as e:
+            logging.warning("NodeManager: Failed to fetch the stats of Lavalink node %s, reason: %s", node.identifier, e)
+            self._stats.pop(node.identifier, None)
+
+    @staticmethod
+    def _load_penalty(stats) -> float:
+        # CPU and frame loss part of the penalty
+        _penalty = 1.05 ** (100 * stats.cpu.system_load) * 10 - 10
+        if stats.frames is not None:
+            _penalty += 1.03 ** (500 * (stats.frames.deficit / 3000)) * 600 - 600
+            _penalty += (1.03 ** (500 * (stats.frames.nulled / 3000)) * 300 - 300) * 2
+        return _penalty
+
+    def _penalty(self, node: wavelink.Node) -> float:
+        # Lower is better, based on the load balancing penalties used by Lavalink clients
+        _stats = self._stats.get(node.identifier)
+        if _stats is not None:
+            return _stats.playing + self._load_penalty(_stats)
+
+        # Nodes without stats yet are assumed to be as loaded as the busiest node with stats so the penalties stay comparable
+        _known = [self._load_penalty(_stats) for _stats in self._stats.values()]
+        return len(node.players) + (max(_known) if _known else 0)
+
+    def select_node(self, region: str = None, exclude: wavelink.Node = None) -> wavelink.Node:
+        _nodes = [
+            _node for _node in wavelink.Pool.nodes.values()
+            if _node.status == wavelink.NodeStatus.CONNECTED and (exclude is None or _node.identifier != exclude.identifier)
+        ]
+        if not _nodes:
+            raise wavelink.InvalidNodeException("No Lavalink nodes are available")
+
+        if region:
+            _regional = [_node for _node in _nodes if region.lower() in self._configs.get(_node.identifier, {}).get("regions", [])]
+            _nodes = _regional or _nodes
+
+        return min(_nodes, key=self._penalty)
+
+    @staticmethod
+    def _region(channel) -> str:
+        return str(channel.rtc_region) if getattr(channel, "rtc_region", None) else None
+
+    def player_factory(self, channel):
+        # Used as cls in channel.connect() to create the player on the selected node
+        return functools.partial(wavelink.Player, nodes=[self.select_node(self._region(channel))])
+
+    async def _move_players(self, node: wavelink.Node, players: list):
+        # Moves the players to other nodes, playback resumes where it stopped
+        _moved = 0
+        for _player in players:
+            try:
+                await _player.switch_node(self.select_node(self._region(_player.channel), exclude=node))
+                _moved += 1
+            except wavelink.InvalidNodeException:
+                logging.warning("NodeManager: No other Lavalink node is available to move the players of node %s", node.identifier)
+                break
+            except Exception as e:
+                logging.error("NodeManager: Failed to move the player of guild %s off Lavalink node %s, reason: %s", _player.guild.id if _player.guild else None, node.identifier, e)
+
+        if _moved:
+            logging.warning("NodeManager: Moved %d of %d players off Lavalink node %s", _moved, len(players), node.identifier)
+
+    async def on_wavelink_node_ready(self, payload: wavelink.NodeReadyEventPayload):
+        # Placement uses the stats right away instead of waiting for the next health check
+        await self._fetch_stats(payload.node)
+
+    async def on_wavelink_node_disconnected(self, payload: wavelink.NodeDisconnectedEventPayload):
+        # Dispatched when the websocket drops and before wavelink retries, the players are still attached to the node
+        self._stats.pop(payload.node.identifier, None)
+        if payload.node.players:
+            await self._move_players(payload.node, list(payload.node.players.values()))
+
+    async def on_wavelink_node_closed(self, node: wavelink.Node, disconnected: list):
+        # Closing a node disconnects its players from voice, this is not a disconnect requested by a user
+        for _player in disconnected:
+            if _player.guild is not None:
+                self._lost_guilds[_player.guild.id] = time.monotonic()
+
+        # Reconnected by the health check
+        logging.warning("NodeManager: Lavalink node %s is closed, %d players were disconnected", node.identifier, len(disconnected))
+
+    def node_lost(self, guild_id: int) -> bool:
+        # Whether the bot left the voice channel of the guild because its node was closed
+        return guild_id in self._lost_guilds
+
+    def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+        for _task in self._connecting.values():
+            _task.cancel()
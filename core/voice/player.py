@@ -0,0 +1,63 @@
+import asyncio
+import discord
+import logging
+
+# Per-guild playback controller, the queue is advanced from wavelink track end events instead of polling the player
+# It is independent of the interaction that started the playback and is shut down when the bot disconnects
+class PlayerController:
+    def __init__(self, cog, guild_id: int, text_channel: discord.abc.Messageable):
+        self.cog = cog
+        self.guild_id = guild_id
+        # Channel where "Now playing" messages are sent, updated to the channel of the last /voice play
+        self.text_channel = text_channel
+
+        self._lock = asyncio.Lock()
+        self._closed = False
+
+    @property
+    def player(self):
+        _guild = self.cog.bot.get_guild(self.guild_id)
+        return _guild.voice_client if _guild is not None else None
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def notify(self, message: str):
+        try:
+            await self.text_channel.send(message)
+        except discord.HTTPException as e:
+            logging.warning("PlayerController: Failed to send a message to guild %s, reason: %s", self.guild_id, e)
+
+    async def advance(self):
+        # Plays the next track in the queue unless a track is already playing
+        # Serialized so concurrent events and commands can't start two tracks at once
+        async with self._lock:
+            if self._closed or self.cog.pendings.get(self.guild_id) == "disconnecting":
+                return
+
+            _player = self.player
+            if _player is None or not _player.connected or _player.current is not None:
+                return
+
+            _queue = self.cog.enqueued_tracks.get(self.guild_id)
+            while _queue:
+                _user_id, _track = _queue.popleft()
+
+                try:
+                    await _player.play(_track)
+                except Exception as e:
+                    logging.error("PlayerController: Failed to play %s in guild %s, reason: %s", _track.title, self.guild_id, e)
+                    await self.notify(f"⚠️ Failed to play track: **{_track.title}**, skipping...")
+                    continue
+
+                # Set the user currently playing the track to check if the user is the one who queued the track
+                self.cog.current_user.update({self.guild_id: _user_id})
+                await self.notify(f"▶️ Now playing track: **{_track.title}**")
+                return
+
+            # Nothing left to play
+            self.cog.current_user.pop(self.guild_id, None)
+
+    def shutdown(self):
+        self._closed = True
@@ -0,0 +1,186 @@
+from collections import deque
+import asyncio
+import json
+import logging
+import os
+
+class _QueueEntry:
+    __slots__ = ("user_id", "track", "removed")
+
+    def __init__(self, user_id: int, track):
+        self.user_id = user_id
+        self.track = track
+        self.removed = False
+
+# Track queue of a guild, entries are (user id, track) in play order
+# A per-user index makes skipping a user's tracks O(1), removed entries are left as tombstones and dropped lazily when they reach the front
+class TrackQueue:
+    def __init__(self):
+        self._entries = deque()
+        # user id -> that user's entries in play order
+        self._by_user = {}
+        self._size = 0
+        self._tombstones = 0
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def __iter__(self):
+        for _entry in self._entries:
+            if not _entry.removed:
+                yield _entry.user_id, _entry.track
+
+    def append(self, user_id: int, track):
+        _entry = _QueueEntry(user_id, track)
+        self._entries.append(_entry)
+        self._by_user.setdefault(user_id, deque()).append(_entry)
+        self._size += 1
+
+    def extend(self, user_id: int, tracks: list):
+        for _track in tracks:
+            self.append(user_id, _track)
+
+    def _drop_tombstones(self, entries: deque):
+        # Drops removed entries at the front of a deque
+        while entries and entries[0].removed:
+            entries.popleft()
+            if entries is self._entries:
+                self._tombstones -= 1
+
+    def _mark_removed(self, entry: _QueueEntry):
+        entry.removed = True
+        self._size -= 1
+        self._tombstones += 1
+
+    def _maybe_compact(self):
+        # Compact once most of the queue is tombstones so memory and iteration stay proportional to the live entries
+        if self._tombstones > 64 and self._tombstones > self._size:
+            self._rebuild(self._live_entries())
+
+    def _rebuild(self, entries: list):
+        self._entries = deque(entries)
+        self._by_user = {}
+        for _entry in entries:
+            self._by_user.setdefault(_entry.user_id, deque()).append(_entry)
+        self._size = len(entries)
+        self._tombstones = 0
+
+    def popleft(self) -> tuple:
+        # Returns the next (user id, track) or None if the queue is empty
+        self._drop_tombstones(self._entries)
+        if not self._entries:
+            return None
+
+        _entry = self._entries.popleft()
+        _user_entries = self._by_user[_entry.user_id]
+        self._drop_tombstones(_user_entries)
+        _user_entries.popleft()
+        if not _user_entries:
+            del self._by_user[_entry.user_id]
+
+        self._size -= 1
+        return _entry.user_id, _entry.track
+
+    def remove_next_by(self, user_id: int):
+        # Removes the next track queued by the user, returns the track or None
+        _user_entries = self._by_user.get(user_id)
+        if _user_entries is None:
+            return None
+
+        self._drop_tombstones(_user_entries)
+        if not _user_entries:
+            del self._by_user[user_id]
+            return None
+
+        _entry = _user_entries.popleft()
+        if not _user_entries:
+            del self._by_user[user_id]
+
+        self._mark_removed(_entry)
+        self._maybe_compact()
+        return _entry.track
+
+    def remove_all_by(self, user_id: int) -> int:
+        # Removes every track queued by the user, returns the number of removed tracks
+        _removed = 0
+        for _entry in self._by_user.pop(user_id, ()):
+            if not _entry.removed:
+                self._mark_removed(_entry)
+                _removed += 1
+        self._maybe_compact()
+        return _removed
+
+    def _live_entries(self) -> list:
+        return [_entry for _entry in self._entries if not _entry.removed]
+
+    def get(self, position: int) -> tuple:
+        # (user id, track) at the 1-based position
+        _entries = self._live_entries()
+        if not 1 <= position <= len(_entries):
+            raise IndexError("Position out of range")
+        return _entries[position - 1].user_id, _entries[position - 1].track
+
+    def remove(self, position: int) -> tuple:
+        # Removes the entry at the 1-based position, returns (user id, track)
+        _entries = self._live_entries()
+        if not 1 <= position <= len(_entries):
+            raise IndexError("Position out of range")
+
+        _entry = _entries.pop(position - 1)
+        self._rebuild(_entries)
+        return _entry.user_id, _entry.track
+
+    def move(self, position: int, new_position: int) -> tuple:
+        # Moves the entry at the 1-based position to new_position, returns (user id, track)
+        _entries = self._live_entries()
+        if not 1 <= position <= len(_entries) or not 1 <= new_position <= len(_entries):
+            raise IndexError("Position out of range")
+
+        _entry = _entries.pop(position - 1)
+        _entries.insert(new_position - 1, _entry)
+        self._rebuild(_entries)
+        return _entry.user_id, _entry.track
+
+    def clear(self):
+        self._rebuild([])
+
+# Saves the queues to a JSON file so they survive restarts, tracks are stored as their encoded Lavalink payload (track.raw_data)
+# Saves are coalesced, a burst of queue changes results in a single write
+class QueueStore:
+    def __init__(self, path: str, delay: float = 2):
+        self.path = path
+        self._delay = delay
+        self._pending = None
+        self._state_func = None
+
+    def schedule_save(self, state_func):
+        # state_func is called when the save happens and returns the JSON serializable state
+        self._state_func = state_func
+        if self._pending is None or self._pending.done():
+            self._pending = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(self._delay)
+        try:
+            await asyncio.to_thread(self._write, self._state_func())
+        except Exception as e:
+            logging.error("QueueStore: Failed to save the queues to %s, reason: %s", self.path, e)
+
+    def _write(self, state: dict):
+        # Write to a temporary file first so a crash while saving doesn't corrupt the previous state
+        with open(f"{self.path}.tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.error("QueueStore: Failed to load the queues from %s, reason: %s", self.path, e)
+            return {}
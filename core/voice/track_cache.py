@@ -0,0 +1,65 @@
+from core.cache import SingleFlight, TTLCache
+from os import environ
+from urllib.parse import parse_qs, urlparse
+import re
+import wavelink
+
+_YOUTUBE_HOSTS = ("youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com")
+_YOUTUBE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+# Resolves /voice play queries to tracks through Lavalink and caches the encoded tracks (track.raw_data) so repeated requests across guilds skip the search
+# Concurrent requests for the same query share one search
+class TrackResolver:
+    def __init__(self):
+        self._cache = TTLCache(
+            "voice_tracks",
+            ttl=float(environ.get("VOICE_TRACK_CACHE_TTL", 3600)),
+            max_size=int(environ.get("VOICE_TRACK_CACHE_SIZE", 512))
+        )
+        self._searches = SingleFlight()
+        self._max_playlist_tracks = int(environ.get("VOICE_PLAYLIST_MAX_TRACKS", 200))
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        # YouTube URLs are keyed by their video ID so different URL forms of the same video share an entry
+        _query = query.strip()
+        _url = urlparse(_query)
+        if _url.scheme in ("http", "https"):
+            _host = (_url.hostname or "").lower()
+            if _host == "youtu.be" and _YOUTUBE_ID_PATTERN.match(_url.path.lstrip("/")):
+                return f"youtube:{_url.path.lstrip('/')}"
+            if _host in _YOUTUBE_HOSTS:
+                # Playlists are keyed by their playlist ID, videos opened from a playlist load the playlist and are keyed by their URL
+                _playlist_id = parse_qs(_url.query).get("list", [None])[0]
+                if _playlist_id:
+                    return f"youtube-playlist:{_playlist_id}" if _url.path == "/playlist" else f"url:{_query}"
+
+                _video_id = parse_qs(_url.query).get("v", [None])[0]
+                if _url.path.startswith("/shorts/"):
+                    _video_id = _url.path.split("/")[2]
+                if _video_id and _YOUTUBE_ID_PATTERN.match(_video_id):
+                    return f"youtube:{_video_id}"
+            return f"url:{_query}"
+
+        # Search queries are case and whitespace insensitive
+        return f"search:{' '.join(_query.lower().split())}"
+
+    async def _search(self, query: str) -> dict:
+        _result = await wavelink.Playable.search(query, source=wavelink.TrackSource.YouTube)
+        if isinstance(_result, wavelink.Playlist):
+            return {"playlist": _result.name, "tracks": [_track.raw_data for _track in _result.tracks[:self._max_playlist_tracks]]}
+
+        # Only the first result of a search is played
+        return {"playlist": None, "tracks": [_track.raw_data for _track in list(_result)[:1]]}
+
+    async def resolve(self, query: str) -> tuple:
+        # Returns (tracks, playlist name), tracks is empty if nothing was found
+        _key = self.normalize(query)
+        _result = self._cache.get(_key)
+        if _result is None:
+            _result = await self._searches.do(_key, self._search, query)
+            if _result["tracks"]:
+                self._cache.set(_key, _result)
+
+        # New track objects each time so players don't share state
+        return [wavelink.Playable(_raw_data) for _raw_data in _result["tracks"]], _result["playlist"]
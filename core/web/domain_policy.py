@@ -0,0 +1,65 @@
+from urllib.parse import urlparse
+import logging
+import os
+import yaml
+
+# Domain exclusion policy, loaded once and reloaded when the file changes
+# Domains are compiled into a trie of reversed labels (com -> youtube) so a lookup matches the domain and all of its subdomains
+class DomainPolicy:
+    # Marks the end of an excluded domain in the trie
+    _TERMINAL = ""
+
+    def __init__(self, path: str = "data/excluded_urls.yaml"):
+        self._path = path
+        self._mtime = None
+        self._trie = {}
+
+    @classmethod
+    def compile(cls, domains: list) -> dict:
+        _trie = {}
+        for _domain in domains or []:
+            _node = _trie
+            for _label in reversed(str(_domain).strip().lower().strip(".").split(".")):
+                _node = _node.setdefault(_label, {})
+            _node[cls._TERMINAL] = True
+        return _trie
+
+    @staticmethod
+    def _parse(path: str) -> list:
+        with open(path, "r") as f:
+            return yaml.safe_load(f)
+
+    async def refresh(self, executors = None):
+        # Reload the policy if the file has changed since it was last loaded
+        try:
+            _mtime = os.stat(self._path).st_mtime
+        except FileNotFoundError:
+            return
+
+        if _mtime == self._mtime:
+            return
+
+        try:
+            _domains = await executors.run_thread(self._parse, self._path) if executors is not None else self._parse(self._path)
+        except Exception as e:
+            # Keep the previous policy
+            logging.error("DomainPolicy: Failed to load %s, reason: %s", self._path, e)
+            return
+
+        self._trie = self.compile(_domains)
+        self._mtime = _mtime
+
+    def is_excluded(self, url: str) -> bool:
+        # Accepts both URLs and bare hostnames
+        _host = urlparse(url).hostname if "//" in url else url
+        if not _host:
+            return False
+
+        _node = self._trie
+        for _label in reversed(_host.lower().strip(".").split(".")):
+            _node = _node.get(_label)
+            if _node is None:
+                return False
+            if self._TERMINAL in _node:
+                return True
+        return False
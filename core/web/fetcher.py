@@ -0,0 +1,79 @@
+from os import environ
+from urllib.parse import urlparse
+import aiohttp
+import asyncio
+import weakref
+import yarl
+
+# Downloads web pages concurrently with a global and per-host concurrency limit
+# Each page has a connect/read deadline and a byte budget, and non-textual pages are skipped before being read
+class PageFetcher:
+    ALLOWED_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+
+    def __init__(self):
+        self._max_bytes = int(environ.get("WEB_FETCH_MAX_BYTES", 2 * 1024 * 1024))
+        self._per_host_limit = int(environ.get("WEB_FETCH_PER_HOST_CONCURRENCY", 2))
+        self._max_redirects = 10
+        self._timeout = aiohttp.ClientTimeout(
+            total=float(environ.get("WEB_FETCH_TIMEOUT", 15)),
+            sock_connect=float(environ.get("WEB_FETCH_CONNECT_TIMEOUT", 5)),
+            sock_read=float(environ.get("WEB_FETCH_READ_TIMEOUT", 10))
+        )
+
+        # Shared across tool calls so the limits apply bot-wide
+        self._semaphore = asyncio.Semaphore(int(environ.get("WEB_FETCH_MAX_CONCURRENCY", 8)))
+        # Semaphores are only kept while a fetch holds or waits for them so the mapping doesn't grow with every host
+        self._host_semaphores = weakref.WeakValueDictionary()
+
+    def _host_semaphore(self, url):
+        _host = urlparse(url).hostname or ""
+        _semaphore = self._host_semaphores.get(_host)
+        if _semaphore is None:
+            _semaphore = asyncio.Semaphore(self._per_host_limit)
+            self._host_semaphores[_host] = _semaphore
+        return _semaphore
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str, url_filter = None) -> str:
+        async with self._semaphore:
+            # Redirects are followed manually so every hop can be checked against the url filter before it is fetched
+            for _ in range(self._max_redirects + 1):
+                if url_filter is not None and url_filter(url):
+                    raise ValueError(f"{url} is excluded")
+
+                # Each hop takes the slot of its own host, the deadline starts once the slot is acquired
+                async with self._host_semaphore(url), session.get(url, allow_redirects=False, timeout=self._timeout) as _response:
+                    if _response.status in (301, 302, 303, 307, 308) and "Location" in _response.headers:
+                        url = str(_response.url.join(yarl.URL(_response.headers["Location"])))
+                        continue
+
+                    return await self._read(_response)
+
+            raise ValueError("Too many redirects")
+
+    async def _read(self, response: aiohttp.ClientResponse) -> str:
+        response.raise_for_status()
+
+        _content_type = response.headers.get("Content-Type", "text/html").split(";")[0].strip().lower()
+        if not _content_type.startswith(self.ALLOWED_CONTENT_TYPES):
+            raise ValueError(f"Unsupported content type {_content_type}")
+
+        # Read up to the byte budget and stop early, the rest of the page is discarded
+        _body = bytearray()
+        async for _chunk in response.content.iter_chunked(65536):
+            _body.extend(_chunk)
+            if len(_body) >= self._max_bytes:
+                del _body[self._max_bytes:]
+                break
+
+        try:
+            return _body.decode(response.charset or "utf-8", errors="replace")
+        except LookupError:
+            return _body.decode("utf-8", errors="replace")
+
+    async def fetch_all(self, urls: list, url_filter = None) -> dict:
+        # Returns url -> page text or the exception raised while fetching
+        # url_filter is a callable returning True for URLs that must not be fetched, including redirects
+        # https://github.com/aio-libs/aiohttp/issues/955#issuecomment-230897285
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as _session:
+            _results = await asyncio.gather(*[self.fetch(_session, _url, url_filter=url_filter) for _url in urls], return_exceptions=True)
+        return dict(zip(urls, _results))
@@ -0,0 +1,120 @@
+from collections import OrderedDict, deque
+from os import environ
+import aiohttp
+import asyncio
+import logging
+
+# Keeps a small buffer of ready posts for recently requested subreddits so requests are served without waiting for meme-api.com
+# Buffers are refilled in the background over a shared session, and recently shown posts are not served again
+class RedditPostPool:
+    API_URL = "https://meme-api.com/gimme"
+
+    def __init__(self):
+        self._buffer_size = int(environ.get("REDDIT_PREFETCH_SIZE", 10))
+        self._max_subreddits = int(environ.get("REDDIT_PREFETCH_SUBREDDITS", 16))
+        # Refill in the background once a buffer drops to this many posts
+        self._low_watermark = max(1, self._buffer_size // 3)
+
+        # subreddit -> deque of posts, least recently requested first
+        self._buffers = OrderedDict()
+        # subreddit -> recently shown post links
+        self._recent = {}
+        # subreddit -> refill task
+        self._refills = {}
+
+        self._timeout = aiohttp.ClientTimeout(total=10)
+        # Created on first use so it binds to the running loop
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False), timeout=self._timeout)
+        return self._session
+
+    def _admit(self, subreddit: str, buffer: deque):
+        # Only subreddits that returned posts are kept, so invalid names can't evict the buffers of popular subreddits
+        self._buffers[subreddit] = buffer
+        self._recent.setdefault(subreddit, deque(maxlen=self._buffer_size * 5))
+        self._buffers.move_to_end(subreddit)
+
+        # Forget the least recently requested subreddits
+        while len(self._buffers) > self._max_subreddits:
+            _evicted, _ = self._buffers.popitem(last=False)
+            self._recent.pop(_evicted, None)
+
+    async def _fetch(self, subreddit: str, count: int) -> list:
+        async with self._get_session().get(f"{self.API_URL}/{subreddit}/{count}") as _response:
+            _data = await _response.json(content_type=None)
+
+        # Errors such as missing or private subreddits are returned as {"code": ..., "message": ...}
+        if "memes" not in _data:
+            raise ValueError(_data.get("message", "Unknown error"))
+        return _data["memes"]
+
+    async def _refill(self, subreddit: str) -> deque:
+        # Fills the buffer of the subreddit, or a new buffer that is kept after the first successful refill
+        _buffer = self._buffers.get(subreddit)
+        _new = _buffer is None
+        if _new:
+            _buffer = deque(maxlen=self._buffer_size)
+
+        _posts = await self._fetch(subreddit, self._buffer_size)
+
+        # Skip posts that were recently shown or are already buffered
+        _seen = set(self._recent.get(subreddit, ())) | {_post.get("postLink") for _post in _buffer}
+        for _post in _posts:
+            if _post.get("postLink") not in _seen and len(_buffer) < _buffer.maxlen:
+                _seen.add(_post.get("postLink"))
+                _buffer.append(_post)
+
+        # Small subreddits may only have posts that were already shown, serve them again rather than nothing
+        if not _buffer and _posts:
+            _buffer.extend(_posts[:1])
+
+        if _new and _buffer:
+            self._admit(subreddit, _buffer)
+        return _buffer
+
+    def _schedule_refill(self, subreddit: str) -> asyncio.Task:
+        _task = self._refills.get(subreddit)
+        if _task is None:
+            _task = asyncio.create_task(self._refill(subreddit))
+            self._refills[subreddit] = _task
+            _task.add_done_callback(lambda _task: self._on_refilled(subreddit, _task))
+        return _task
+
+    def _on_refilled(self, subreddit: str, task: asyncio.Task):
+        self._refills.pop(subreddit, None)
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning("RedditPostPool: Failed to prefetch r/%s, reason: %s", subreddit, task.exception())
+
+    async def get(self, subreddit: str) -> dict:
+        _subreddit = subreddit.strip().lower().removeprefix("r/")
+        _buffer = self._buffers.get(_subreddit)
+        if _buffer is not None:
+            self._buffers.move_to_end(_subreddit)
+
+        # Cold or drained buffer, wait for the refill (shared with concurrent requests)
+        # Concurrent waiters may drain the refilled buffer before this request resumes, refill once more in that case
+        for _ in range(2):
+            if _buffer:
+                break
+            _buffer = await asyncio.shield(self._schedule_refill(_subreddit))
+        if not _buffer:
+            raise ValueError(f"No posts available in r/{_subreddit} at the moment")
+
+        _post = _buffer.popleft()
+        # The subreddit may have been evicted (or never kept) while waiting for the refill
+        if _subreddit in self._recent:
+            self._recent[_subreddit].append(_post.get("postLink"))
+
+        if len(_buffer) <= self._low_watermark and _subreddit in self._buffers:
+            self._schedule_refill(_subreddit)
+
+        return _post
+
+    async def close(self):
+        for _task in list(self._refills.values()):
+            _task.cancel()
+        if self._session is not None:
+            await self._session.close()
@@ -1,3 +1,8 @@
+from core.ai.media import MediaPipeline
+from core.diagnostics import LoopLagMonitor
+from core.entities import EntityCache
+from core.executors import Executors
+from core.huggingface.spaces import SpacesClientPool
 from discord.ext import bridge, commands
 from dotenv import load_dotenv
 from inspect import cleandoc
@@ -18,6 +23,11 @@ load_dotenv("dev.env")
 # Logging
 logging.basicConfig(format='%(levelname)s %(asctime)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
 
+# Shared process and thread pools for CPU heavy work
+# Process pool workers are forked before anything else starts threads
+executors = Executors()
+executors.start()
+
 # Playback support
 try:
     wavelink = importlib.import_module("wavelink")
@@ -42,6 +52,21 @@ intents.members = True
 # Bot
 bot = bridge.Bot(command_prefix=commands.when_mentioned_or("$"), intents = intents)
 
+# Shared cache of Discord users and members
+bot.entity_cache = EntityCache(bot)
+
+# Shared attachment downloads and uploads for multimodal prompts
+bot.media_pipeline = MediaPipeline()
+
+# Shared process and thread pools for CPU heavy work
+bot.executors = executors
+
+# Warm gradio clients for Hugging Face spaces
+bot.hf_spaces = SpacesClientPool()
+
+# Event loop lag and task age sampling for $admin_diag
+bot.loop_monitor = LoopLagMonitor()
+
 ###############################################
 # ON READY
 ###############################################
@@ -49,25 +74,16 @@ bot = bridge.Bot(command_prefix=commands.when_mentioned_or("$"), intents = inten
 async def on_ready():
     global wavelink
 
+    bot.loop_monitor.start()
+
     # start wavelink setup if playback support is enabled
+    # Nodes are connected in the background and reconnected by the node manager, an unreachable node doesn't disable playback
     if wavelink is not None:
         try:
-            # https://wavelink.dev/en/latest/recipes.html
-            ENV_LAVALINK_URI = environ.get("ENV_LAVALINK_URI") if environ.get("ENV_LAVALINK_URI") is not None else "http://127.0.0.1:2222"
-            ENV_LAVALINK_PASS = environ.get("ENV_LAVALINK_PASS") if environ.get("ENV_LAVALINK_PASS") is not None else "youshallnotpass"
-            ENV_LAVALINK_IDENTIFIER = environ.get("ENV_LAVALINK_IDENTIFIER") if environ.get("ENV_LAVALINK_IDENTIFIER") is not None else "main"
-
-            node = wavelink.Node(
-                identifier=ENV_LAVALINK_IDENTIFIER,
-                uri=ENV_LAVALINK_URI,
-                password=ENV_LAVALINK_PASS
-            )
-
-            await wavelink.Pool.connect(
-                client=bot,
-                nodes=[node]
-            )
-        except wavelink.WavelinkException as e:
+            if not hasattr(bot, "voice_nodes"):
+                bot.voice_nodes = importlib.import_module("core.voice.nodes").NodeManager(bot)
+            bot.voice_nodes.start()
+        except Exception as e:
             logging.error(f"Failed to setup wavelink: {e}... Disabling playback support")
             wavelink = None
     
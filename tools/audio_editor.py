@@ -1,9 +1,9 @@
 # Huggingface spaces endpoints 
 import google.generativeai as genai
 import aiofiles.os
-import asyncio
 import discord
 import importlib
+import logging
 
 # Function implementations
 class Tool:
@@ -44,32 +44,57 @@ class Tool:
         # Import
         try:
             gradio_client = importlib.import_module("gradio_client")
-            os = importlib.import_module("os")
+            spaces = importlib.import_module("core.huggingface.spaces")
+            audio = importlib.import_module("core.huggingface.audio")
         except ModuleNotFoundError:
             return "This tool is not available at the moment"
 
+        _view = spaces.JobCancelView(self.ctx.author.id, timeout=self.bot.hf_spaces.job_timeout)
+        message_curent = await self.ctx.send("🎤✨ Adding some magic to the audio...", view=_view)
+
+        # Only upload a window around the edit region when ffmpeg is available, otherwise the whole file is sent
+        _window = None
+        if audio.is_available():
+            try:
+                _window = await audio.cut_window(self.file_uri, edit_start_in_seconds, edit_length_in_seconds)
+            except Exception as e:
+                logging.warning("EzAudio: Failed to cut the audio window, sending the whole file, reason: %s", e)
+
         try:
-            message_curent = await self.ctx.send("🎤✨ Adding some magic to the audio...")
-            result = await asyncio.to_thread(
-                gradio_client.Client("OpenSound/EzAudio").predict,
+            result = await self.bot.hf_spaces.submit(
+                "OpenSound/EzAudio",
                 text=prompt,
                 boundary=2,
-                gt_file=gradio_client.handle_file(self.file_uri),
-                mask_start=edit_start_in_seconds,
-                mask_length=edit_length_in_seconds,
+                gt_file=gradio_client.handle_file(_window.path if _window is not None else self.file_uri),
+                mask_start=_window.edit_start if _window is not None else edit_start_in_seconds,
+                mask_length=_window.edit_length if _window is not None else edit_length_in_seconds,
                 guidance_scale=5,
                 guidance_rescale=0,
                 ddim_steps=50,
                 eta=1,
                 random_seed=0,
                 randomize_seed=True,
-                api_name="/editing_audio_1"
+                api_name="/editing_audio_1",
+                on_status=lambda status: message_curent.edit(content=status),
+                cancelled=_view.cancelled
             )
+            # Put the edited window back into the original audio
+            if _window is not None:
+                _edited = result
+                try:
+                    result = await audio.splice(_window, _edited, audio.output_format(self.file_uri))
+                finally:
+                    await aiofiles.os.remove(_edited)
+        except spaces.JobCancelled:
+            return "Audio editing was cancelled by the user"
         except Exception as e:
             return f"I can't edit the audio, reason {e}"
-        
-        # Delete status
-        await message_curent.delete()
+        finally:
+            # Delete status
+            _view.stop()
+            await message_curent.delete()
+            if _window is not None:
+                await _window.cleanup()
 
         # Send the audio
         await self.ctx.send(file=discord.File(fp=result))
@@ -1,8 +1,5 @@
 # Huggingface spaces endpoints 
 import google.generativeai as genai
-import aiofiles.os
-import asyncio
-import discord
 import importlib
 
 # Function implementations
@@ -41,16 +38,18 @@ class Tool:
 
         # Import
         try:
-            gradio_client = importlib.import_module("gradio_client")
-            os = importlib.import_module("os")
+            importlib.import_module("gradio_client")
+            spaces = importlib.import_module("core.huggingface.spaces")
+            images = importlib.import_module("core.huggingface.images")
         except ModuleNotFoundError:
             return "This tool is not available at the moment"
 
         # Create image
+        _view = spaces.JobCancelView(self.ctx.author.id, timeout=self.bot.hf_spaces.job_timeout)
+        message_curent = await self.ctx.send("⌛ Generating an image...", view=_view)
         try:
-            message_curent = await self.ctx.send("⌛ Generating an image... this may take few minutes")
-            result = await asyncio.to_thread(
-                gradio_client.Client("stabilityai/stable-diffusion-3-medium").predict,
+            result = await self.bot.hf_spaces.submit(
+                "stabilityai/stable-diffusion-3-medium",
                 prompt=image_description,
                 negative_prompt=f"low quality, distorted, bad art, strong violence, sexually explicit, disturbing",
                 width=width,
@@ -59,17 +58,22 @@ class Tool:
                 seed=0,
                 randomize_seed=True,
                 num_inference_steps=30,
-                api_name="/infer"
+                api_name="/infer",
+                on_status=lambda status: message_curent.edit(content=status),
+                cancelled=_view.cancelled
             )
+        except spaces.JobCancelled:
+            return "Image generation was cancelled by the user"
         except Exception as e:
             return f"Image generation fail and the image isn't sent, reason {e}"
-        
-        # Delete status
-        await message_curent.delete()
+        finally:
+            # Delete status
+            _view.stop()
+            await message_curent.delete()
 
-        # Send the image
-        await self.ctx.send(file=discord.File(fp=result[0]))
-
-        # Cleanup
-        await aiofiles.os.remove(result[0])
+        # Compress and send the image, the generated file is removed afterwards
+        try:
+            await self.ctx.send(file=await images.prepare_image(self.bot.executors, result[0], max_bytes=images.upload_limit(self.ctx)))
+        except Exception as e:
+            return f"Image generation success but the image can't be sent, reason {e}"
         return "Image generation success and the file should be sent automatically"
@@ -1,6 +1,6 @@
 # Built in Tools
+from core.web.reddit import RedditPostPool
 import google.generativeai as genai
-import importlib
 
 # Function implementations
 class Tool:
@@ -11,6 +11,10 @@ class Tool:
         self.bot = bot
         self.ctx = ctx
 
+        # Shared across tool calls so prefetched posts and connections are reused, closed on shutdown
+        if not hasattr(self.bot, "reddit_posts"):
+            self.bot.reddit_posts = RedditPostPool()
+
         # Random Reddit
         self.tool_schema = genai.protos.Tool(
             function_declarations=[
@@ -29,17 +33,12 @@ class Tool:
         )
 
     async def _tool_function(self, subreddit: str):
-        # Fetch subreddit
-        aiohttp = importlib.import_module("aiohttp")
-
-        # GET meme-api.com
+        # Served from the prefetch buffer, only the first request for a subreddit waits for meme-api.com
         try:
-            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False)) as session:
-                async with await session.get(f"https://meme-api.com/gimme/{subreddit}") as request:
-                    subreddit = await request.json()
+            subreddit = await self.bot.reddit_posts.get(subreddit)
         except Exception as e:
             return f"An error has occured while fetching reddit, reason: {e}"
-        
+
         # Serialize objects and get the URL, image preview and title
         rdt_url = subreddit.get("postLink", "N/A")
         rdt_image = subreddit.get("url", "N/A")
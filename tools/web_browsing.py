@@ -1,12 +1,25 @@
-from core.ai.embeddings import GeminiDocumentRetrieval
+from core.web.domain_policy import DomainPolicy
+from core.web.fetcher import PageFetcher
 from google_labs_html_chunker.html_chunker import HtmlChunker
 import google.generativeai as genai
-import aiofiles
 import asyncio
 import discord
 import importlib
 import os
-import yaml
+
+# Shared across tool calls so the fetch concurrency limits apply bot-wide
+_page_fetcher = PageFetcher()
+
+# Excluded domains, loaded once and reloaded when the file changes
+_domain_policy = DomainPolicy("data/excluded_urls.yaml")
+
+# Runs in the executor process pool, must be a module level function to be picklable
+def _chunk_html(docs, chunk_size):
+    return HtmlChunker(
+        max_words_per_aggregate_passage=chunk_size,
+        greedily_aggregate_sibling_nodes=True,
+        html_tags_to_exclude={"noscript", "script", "style"}
+    ).chunk(docs)
 
 # Function implementations
 class Tool:
@@ -39,12 +52,16 @@ class Tool:
         # Limit searches upto 6 results due to context length limits
         max_results = min(max_results, 6)
 
+        # Retrieval engine used for relevance and similarity, local ranks chunks in-process while chroma requires a chroma server
+        _retrieval_engine = os.environ.get("WEB_RETRIEVAL_ENGINE", "local").lower()
+
         # Import required libs
         try:
-            aiohttp = importlib.import_module("aiohttp")
-
             # For relevance and similarity
-            chromadb = importlib.import_module("chromadb")
+            if _retrieval_engine == "chroma":
+                chromadb = importlib.import_module("chromadb")
+            else:
+                VectorRanker = importlib.import_module("core.ai.retrieval").VectorRanker
             ddg = importlib.import_module("duckduckgo_search")
 
             # Needed for some websites
@@ -54,19 +71,17 @@ class Tool:
 
         links = []
 
-        # Load excluded urls list
-        async with aiofiles.open("data/excluded_urls.yaml") as x:
-            excluded_url_list = yaml.safe_load(x)
-
-        # Iterate
-        excluded_urls = " ".join([f"-site:{x}" for x in excluded_url_list])
+        # Reload excluded urls list if it has changed
+        await _domain_policy.refresh(self.bot.executors)
 
         # Perform search using AsyncDDGs to fully support asynchronous searches
         try:
-            results = await ddg.AsyncDDGS(proxy=None).atext(f"{query} {excluded_urls}", max_results=int(max_results))
+            results = await ddg.AsyncDDGS(proxy=None).atext(query, max_results=int(max_results))
             msg = await self.ctx.send(f"🔍 Searching for **{query}**")
-            # Iterate over searches with results from URL
+            # Iterate over searches with results from URL, excluded sites are filtered locally
             for urls in results:
+                if _domain_policy.is_excluded(urls["href"]):
+                    continue
                 await msg.edit(f"➡️ Searched for **{urls['title']}**")
                 links.append(urls["href"])
             await msg.delete()
@@ -79,21 +94,14 @@ class Tool:
         
         page_contents = {}
         try:
-            # Create ClientSession
-            # https://github.com/aio-libs/aiohttp/issues/955#issuecomment-230897285
-            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False)) as session:
-                for url in links:
-                    try:
-                        # Perform a request
-                        async with session.get(url, allow_redirects=True, timeout=max_results) as request:
-                            _page_text = await request.text()
-                    except Exception:
-                        await self.ctx.send(f"⚠️ Failed to browse: **<{url}>**")
-                        continue
-
-                    # Format
-                    page_contents.update({f"{url}": f"{_page_text}"})
-    
+            # Fetch all pages concurrently
+            for url, _page_text in (await _page_fetcher.fetch_all(links, url_filter=_domain_policy.is_excluded)).items():
+                if isinstance(_page_text, Exception):
+                    await self.ctx.send(f"⚠️ Failed to browse: **<{url}>**")
+                    continue
+
+                # Format
+                page_contents.update({f"{url}": f"{_page_text}"})
         except Exception as e:
             return f"An error has occured during web browsing process, reason: {e}"
 
@@ -101,68 +109,46 @@ class Tool:
         if len(page_contents) == 0 and type(page_contents) != list:
             return f"No pages were scrapped and no data is provided"
 
-        result = None
         # Perform vector similarity search
         try:
             _msgstatus = await self.ctx.send("📄 Extracting relevant details...")
 
-            # check if we can connect to chroma server
-            _chroma_http_host = os.environ.get("CHROMA_HTTP_HOST")
-            _chroma_http_port = os.environ.get("CHROMA_HTTP_PORT")
-            if not _chroma_http_host and not _chroma_http_port:
-                return f"A chroma server is not running, I cannot perform web search"
-
-            _chroma_client = await chromadb.AsyncHttpClient(host=_chroma_http_host, port=_chroma_http_port)
-
-            # collection name
-            _cln = f"{importlib.import_module('random').randint(50000, 60000)}_jakeybot_db_query_search"
-
-            # create a collection
-            _collection = await _chroma_client.get_or_create_collection(name=_cln)
-
             _chunk_size = 275
-            # chunk and add documents
-            async def __batch_chunker(url, docs):
-                await _msgstatus.edit(f"🔍 Extracting relevant details from **{url}**")
-
-                # chunk to 275 characters
-                # returns the list of tuples of chunked documents associated with the url
-                _chunked = HtmlChunker(
-                    max_words_per_aggregate_passage=_chunk_size,
-                    greedily_aggregate_sibling_nodes=True,
-                    html_tags_to_exclude={"noscript", "script", "style"}
-                ).chunk(docs)
-                for ids, chunk in enumerate(_chunked):
-                    await _collection.add(
-                        documents=[chunk],
-                        metadatas=[{"url":url}],
-                        ids=[f"{url}_{ids}"]
-                    )
-
-            # tasks
-            _tasks = [__batch_chunker(url, docs) for url, docs in page_contents.items()]
-            await asyncio.gather(*_tasks)
+            # chunk to 275 words off the event loop, all pages at once
+            # url -> list of chunked documents associated with the url
+            await _msgstatus.edit(f"🔍 Extracting relevant details from **{len(page_contents)}** pages")
+            _chunked_pages = dict(zip(page_contents, await asyncio.gather(*[
+                self.bot.executors.run_cpu(_chunk_html, docs, _chunk_size) for docs in page_contents.values()
+            ])))
+
+            if _retrieval_engine == "chroma":
+                # check if we can connect to chroma server
+                _chroma_http_host = os.environ.get("CHROMA_HTTP_HOST")
+                _chroma_http_port = os.environ.get("CHROMA_HTTP_PORT")
+                if not _chroma_http_host and not _chroma_http_port:
+                    return f"A chroma server is not running, I cannot perform web search"
+
+                _ranked_pages = await self._chroma_rank(chromadb, _chroma_http_host, _chroma_http_port, query, _chunked_pages)
+            elif _retrieval_engine == "hybrid":
+                # Only embed the best lexical matches of each page and re-rank them semantically
+                _ranked_pages = await VectorRanker().rank(query, _chunked_pages, top_k=10, candidates=int(os.environ.get("WEB_HYBRID_CANDIDATES", 30)))
+            else:
+                # Embed all chunks in batches and rank them in-process
+                _ranked_pages = await VectorRanker().rank(query, _chunked_pages, top_k=10)
 
             # Aggregate results, anchor queries associated with their URLs
             _result = []
             
-            for url, _ in page_contents.items():
+            for url in page_contents:
                 _result.append("Result from {}:\n=======================\n{}\n=======================\n".format(
                     url, 
-                    "\n".join((await _collection.query(
-                            query_texts=query,
-                            n_results=10,
-                            where={"url": url}
-                        ))["documents"][0])
+                    "\n".join(_ranked_pages.get(url, []))
                 ))
 
             if os.environ.get("_WEB_ENABLE_DEBUG") == "1":
                 print(_result, end="\n\n")
                 print("\n".join(_result))
 
-            # delete collection
-            await _chroma_client.delete_collection(name=_cln)
-
             await _msgstatus.delete()
 
         except Exception as e:
@@ -182,3 +168,36 @@ class Tool:
 
         # Join page contents
         return f"Here is the extracted web pages aggregated based on the query {query}: \n" + "\n".join(_result)
+
+    async def _chroma_rank(self, chromadb, host, port, query, chunked_pages):
+        _chroma_client = await chromadb.AsyncHttpClient(host=host, port=port)
+
+        # collection name
+        _cln = f"{importlib.import_module('random').randint(50000, 60000)}_jakeybot_db_query_search"
+
+        # create a collection
+        _collection = await _chroma_client.get_or_create_collection(name=_cln)
+
+        try:
+            # add all chunks of the page at once
+            for url, chunks in chunked_pages.items():
+                if len(chunks) == 0:
+                    continue
+
+                await _collection.add(
+                    documents=chunks,
+                    metadatas=[{"url":url} for _ in chunks],
+                    ids=[f"{url}_{ids}" for ids in range(len(chunks))]
+                )
+
+            _ranked_pages = {}
+            for url in chunked_pages:
+                _ranked_pages[url] = (await _collection.query(
+                    query_texts=query,
+                    n_results=10,
+                    where={"url": url}
+                ))["documents"][0]
+            return _ranked_pages
+        finally:
+            # delete collection
+            await _chroma_client.delete_collection(name=_cln)
@@ -1,7 +1,39 @@
 # Built in Tools
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
 import google.generativeai as genai
+import asyncio
 import importlib
 
+# yt_dlp is blocking, extractions run on a dedicated pool so a slow lookup never stalls the event loop
+# Lookups beyond the workers wait for a free slot instead of piling up on the pool
+_extract_workers = int(environ.get("YOUTUBE_MAX_WORKERS", 2))
+_extract_pool = ThreadPoolExecutor(max_workers=_extract_workers, thread_name_prefix="jakey-youtube")
+_extract_slots = asyncio.Semaphore(_extract_workers * 2)
+_extract_timeout = float(environ.get("YOUTUBE_EXTRACT_TIMEOUT", 20))
+
+def _extract_info(yt_dlp, query: str, flat: bool) -> dict:
+    _options = {
+        "quiet": True,
+        "no_warnings": True,
+        "skip_download": True,
+        "noplaylist": True,
+        # Bounds each network call inside the worker, the overall lookup is bounded by _extract_timeout
+        "socket_timeout": min(_extract_timeout, 10)
+    }
+    # Search results only need metadata, flat extraction skips resolving formats of every entry
+    if flat:
+        _options["extract_flat"] = "in_playlist"
+
+    with yt_dlp.YoutubeDL(_options) as ydl:
+        return ydl.sanitize_info(ydl.extract_info(query, download=False))
+
+def _release_slot(future: asyncio.Future):
+    _extract_slots.release()
+    # Retrieve the exception of abandoned extractions so it isn't logged as never retrieved
+    if not future.cancelled():
+        future.exception()
+
 # Function implementations
 class Tool:
     tool_human_name = "YouTube Search"
@@ -21,42 +53,60 @@ class Tool:
                         type=genai.protos.Type.OBJECT,
                         properties={
                             'query':genai.protos.Schema(type=genai.protos.Type.STRING),
-                            'is_youtube_link':genai.protos.Schema(type=genai.protos.Type.BOOLEAN)
+                            'is_youtube_link':genai.protos.Schema(type=genai.protos.Type.BOOLEAN),
+                            'max_results':genai.protos.Schema(type=genai.protos.Type.NUMBER)
                         },
                         required=['query', 'is_youtube_link']
                     )
                 )
             ]
         )
-    
-    async def _tool_function(self, query: str, is_youtube_link: bool):
+
+    async def _tool_function(self, query: str, is_youtube_link: bool, max_results: int = 1):
         # Limit searches 1-10 results
-        #if max_results > 10 or max_results < 1:
-        #    max_results = 10
+        max_results = max(1, min(int(max_results), 10))
 
-        ytquery = f"ytsearch:{query}" if not is_youtube_link else query
+        ytquery = f"ytsearch{max_results}:{query}" if not is_youtube_link else query
 
         # Import yt_dlp
         try:
             yt_dlp = importlib.import_module("yt_dlp")
             inspect = importlib.import_module("inspect")
 
-            with yt_dlp.YoutubeDL() as ydl:
-                info = ydl.sanitize_info(ydl.extract_info(ytquery, download=False))
+            # A timed out extraction keeps running in its worker, the slot is only released once the worker is done with it
+            await _extract_slots.acquire()
+            try:
+                _future = asyncio.get_running_loop().run_in_executor(_extract_pool, _extract_info, yt_dlp, ytquery, not is_youtube_link)
+            except BaseException:
+                _extract_slots.release()
+                raise
+            _future.add_done_callback(_release_slot)
+
+            info = await asyncio.wait_for(asyncio.shield(_future), timeout=_extract_timeout)
         except ModuleNotFoundError:
             return "This tool is not available at the moment"
+        except asyncio.TimeoutError:
+            return "YouTube took too long to respond, try again later"
         except Exception as e:
             return f"An error occurred: {e}"
-        
+
+        _entries = info.get("entries") if not is_youtube_link else [info]
+        if not _entries:
+            return "No results found"
+
         # Serialize objects and get the URL, title, description, and channel
-        return inspect.cleandoc(f"""
-            YouTube search results, provide links as is, never use markdown hyperlinks as []():
-            ---
-            Title: {info['entries'][0]['title'] if not is_youtube_link else info['title']}
-            Description: {info['entries'][0]['description'] if not is_youtube_link else info['description']}
-            Channel URL: {info['entries'][0]['channel_url'] if not is_youtube_link else info['channel_url']}
-            Publisher name: {info['entries'][0]['channel'] if not is_youtube_link else info['channel']}
-            Video URL: {info['entries'][0]['webpage_url'] if not is_youtube_link else info['webpage_url']}
-            Published at: {info['entries'][0]['upload_date'] if not is_youtube_link else info['upload_date']} (YYYYMMDD)
-            ---
-        """)
+        # Flat search entries don't include every field, missing ones are marked as unknown
+        _results = []
+        for _entry in _entries[:max_results]:
+            _video_url = _entry.get("webpage_url") or _entry.get("url") or f"https://www.youtube.com/watch?v={_entry.get('id')}"
+            _results.append(inspect.cleandoc(f"""
+                Title: {_entry.get('title', 'Unknown')}
+                Description: {_entry.get('description') or 'Unknown'}
+                Channel URL: {_entry.get('channel_url', 'Unknown')}
+                Publisher name: {_entry.get('channel') or _entry.get('uploader', 'Unknown')}
+                Video URL: {_video_url}
+                Published at: {_entry.get('upload_date') or 'Unknown'} (YYYYMMDD)
+                Duration: {_entry.get('duration') or 'Unknown'} seconds
+            """))
+
+        return "YouTube search results, provide links as is, never use markdown hyperlinks as []():\n---\n" + "\n---\n".join(_results) + "\n---"